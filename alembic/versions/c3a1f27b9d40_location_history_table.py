@@ -0,0 +1,49 @@
+"""location history table
+
+Revision ID: c3a1f27b9d40
+Revises: 98ebefa7395e
+Create Date: 2026-10-17 12:04:31.215487
+
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a1f27b9d40'
+down_revision: Union[str, None] = '98ebefa7395e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# daily partitions (UTC) created up front, the application creates the following days itself
+INITIAL_PARTITIONS_DAYS = 3
+
+
+def upgrade() -> None:
+    op.create_table('location_history',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('recorded_at', postgresql.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('latitude', sa.Double(), nullable=False),
+    sa.Column('longitude', sa.Double(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'recorded_at'),
+    postgresql_partition_by='RANGE (recorded_at)'
+    )
+
+    for offset in range(INITIAL_PARTITIONS_DAYS):
+        day = datetime.now(timezone.utc).date() + timedelta(days=offset)
+        op.execute(
+            f"""
+            CREATE TABLE location_history_{day:%Y%m%d}
+            PARTITION OF location_history
+            FOR VALUES FROM ('{day.isoformat()} 00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00+00');
+            """
+        )
+
+
+def downgrade() -> None:
+    # dropping the partitioned table drops all of its partitions
+    op.drop_table('location_history')
@@ -1,19 +1,32 @@
 import asyncio
+import json
+from datetime import datetime
 from typing import Annotated
+from uuid import UUID
 
-from fastapi import APIRouter, Depends, Request
-from pydantic import UUID4
+from fastapi import APIRouter, Body, Depends, Header, Query, Request, status, WebSocket
+from fastapi.websockets import WebSocketDisconnect
+from pydantic import UUID4, ValidationError
 from sse_starlette import EventSourceResponse
 
 from app.chat.service import MessageService
-from app.chat.schemas import MessageIn, MessageBase
+from app.chat.schemas import (
+    ChatSocketMessageIn,
+    InboxPage,
+    MessageAckIn,
+    MessageIn,
+    MessageBase,
+    MessageOut,
+    MessagePage
+)
 from app.friends.service import FriendshipService
-from core.fastapi.dependencies.permission import IsAuthenticated, PermissionDependencyHTTP
+from core.fastapi.dependencies.permission import IsAuthenticated, PermissionDependencyHTTP, PermissionDependencyWebsocket
 from core.fastapi.schemas.current_user import CurrentUser
-from core.exceptions import MessageToSelfException, MessageToNonFriendException
+from core.exceptions import CustomException, MessageToSelfException, MessageToNonFriendException
 
 chat_router = APIRouter(prefix="/chats", tags=["Chats"])
 
+MAX_BATCH_MESSAGES = 500
 STREAM_DELAY = 1  # second
 RETRY_TIMEOUT = 15000  # milisecond
 
@@ -42,31 +55,224 @@ async def send_message(
     )
 
 
+@chat_router.post("/batch", response_model=list[MessageOut])
+async def send_messages(
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        message_service: Annotated[MessageService, Depends()],
+        messages: Annotated[list[MessageBase], Body(min_length=1, max_length=MAX_BATCH_MESSAGES)]
+):
+    """
+    Send several messages at once, for clients flushing a queue of messages written offline.
+
+    Args:
+        messages (list[MessageBase]): The messages, oldest first.
+
+    Returns:
+        list[MessageOut]: The stored messages, in the same order.
+    """
+    for message in messages:
+        if is_message_to_self(sender_id=current_user.id, recipient_id=message.recipient_id):
+            raise MessageToSelfException()
+
+    return await message_service.send_messages(
+        messages=[
+            MessageIn.model_validate({**message.model_dump(), "sender_id": current_user.id})
+            for message in messages
+        ]
+    )
+
+
+@chat_router.get("/", response_model=InboxPage)
+async def get_inbox(
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        message_service: Annotated[MessageService, Depends()],
+        before: datetime | None = None,
+        before_conversation_id: UUID | None = None,
+        limit: Annotated[int, Query(gt=0, le=200)] = 50,
+):
+    """
+    Get the conversations of the current user, most recent first.
+
+    Args:
+        before (datetime | None): next_before of the previous page.
+        before_conversation_id (UUID | None): next_before_conversation_id of the previous page.
+        limit (int): The maximum number of conversations per page.
+
+    Returns:
+        InboxPage: The conversations with their last message and unread count.
+    """
+    return await message_service.get_inbox(
+        user_id=current_user.id, before=before, before_conversation_id=before_conversation_id, limit=limit
+    )
+
+
+@chat_router.get("/search", response_model=MessagePage)
+async def search_messages(
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        message_service: Annotated[MessageService, Depends()],
+        q: Annotated[str, Query(min_length=1, max_length=200)],
+        before: UUID | None = None,
+        limit: Annotated[int, Query(gt=0, le=100)] = 20,
+):
+    """
+    Search the messages sent or received by the current user, newest first.
+
+    Args:
+        q (str): Words to search, a message matches if it contains any of them.
+        before (UUID | None): next_before of the previous page.
+        limit (int): The maximum number of messages per page.
+
+    Returns:
+        MessagePage: The matching messages and the cursor of the next page.
+    """
+    return await message_service.search_messages(user_id=current_user.id, query=q, before=before, limit=limit)
+
+
 @chat_router.get("/stream")
 async def message_stream(
         message_service: Annotated[MessageService, Depends()],
         current_user: Annotated[CurrentUser, Depends(
             PermissionDependencyHTTP([IsAuthenticated], all_required=True)
         )],
+        last_event_id: Annotated[str | None, Header()] = None,
 ):
+    """
+    Stream the messages sent to the current user.
+
+    Event ids are change stream resume tokens, a client reconnecting with Last-Event-ID receives
+    the messages it missed before the live ones.
+    """
     async def casting():
-        async for change in message_service.subscribe_to_change_stream(user_id=current_user.id):
-            if change:
-                yield {
-                    "event": "new_message",
-                    "id": change.id,
-                    "data": change.model_dump_json()
-                }
+        async for resume_token, change in message_service.subscribe_to_change_stream(
+                user_id=current_user.id, last_event_id=last_event_id
+        ):
+            yield {
+                "event": "new_message",
+                "id": resume_token,
+                "data": change.model_dump_json()
+            }
 
     return EventSourceResponse(casting(), media_type="text/event-stream")
 
 
-@chat_router.get("/{recipient_id}")
+@chat_router.websocket("/ws")
+async def chat_socket(
+        websocket: WebSocket,
+        message_service: Annotated[MessageService, Depends()],
+        current_user: Annotated[CurrentUser, Depends(PermissionDependencyWebsocket([IsAuthenticated]))],
+):
+    """
+    Send and receive messages over a single connection.
+
+    Client frames:
+        {"type": "message", "client_message_id", "recipient_id", "content"}: send a message, answered
+            with {"type": "sent", "client_message_id", "message"}. client_message_id is required, a
+            retry must reuse it and gets the stored message instead of a duplicate.
+        {"type": "delivered" | "read", "message_ids"}: acknowledge received messages.
+
+    Server frames:
+        {"type": "message", "message"}: a message sent to the current user.
+        {"type": "delivered" | "read", "message_ids", "user_id"}: acks of the messages the user sent.
+        {"type": "error", "message", "client_message_id"}: a frame was rejected, the socket stays open.
+    """
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+
+    async def send(frame: str) -> None:
+        async with send_lock:
+            await websocket.send_text(frame)
+
+    async def forward_messages():
+        async for _, message in message_service.subscribe_to_change_stream(user_id=current_user.id):
+            await send(f'{{"type": "message", "message": {message.model_dump_json()}}}')
+        # the subscription only ends when the client could not keep up, make it reconnect
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+    async def forward_acks():
+        async for ack in message_service.subscribe_to_acks(user_id=current_user.id):
+            await send(ack)
+
+    forwarders = [asyncio.create_task(forward_messages()), asyncio.create_task(forward_acks())]
+    try:
+        while True:
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received["code"])
+
+            client_message_id = None
+            try:
+                # a binary frame has no text and is rejected like malformed JSON
+                frame = json.loads(received.get("text") or "")
+                client_message_id = frame.get("client_message_id") if isinstance(frame, dict) else None
+                if isinstance(frame, dict) and frame.get("type") == "message":
+                    message = ChatSocketMessageIn.model_validate(frame)
+                    if is_message_to_self(sender_id=current_user.id, recipient_id=message.recipient_id):
+                        raise MessageToSelfException()
+
+                    stored = await message_service.send_message(
+                        message=MessageIn.model_validate({**message.model_dump(), "sender_id": current_user.id})
+                    )
+                    await send(f'{{"type": "sent", "client_message_id": {json.dumps(client_message_id)}, '
+                               f'"message": {stored.model_dump_json()}}}')
+                else:
+                    ack = MessageAckIn.model_validate(frame)
+                    await message_service.acknowledge_messages(
+                        user_id=current_user.id, message_ids=ack.message_ids, status=ack.type
+                    )
+            except (json.JSONDecodeError, ValidationError):
+                await send(json.dumps({"type": "error", "message": "Invalid frame", "client_message_id": client_message_id}))
+            except CustomException as e:
+                await send(json.dumps({"type": "error", "message": e.message, "client_message_id": client_message_id}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for forwarder in forwarders:
+            forwarder.cancel()
+        # let the subscriptions of the forwarders close before the handler returns
+        await asyncio.gather(*forwarders, return_exceptions=True)
+
+
+@chat_router.get("/{recipient_id}", response_model=MessagePage)
 async def get_messages(
         recipient_id: UUID4,
         current_user: Annotated[CurrentUser, Depends(
             PermissionDependencyHTTP([IsAuthenticated], all_required=True)
         )],
         message_service: Annotated[MessageService, Depends()],
+        before: UUID | None = None,
+        limit: Annotated[int, Query(gt=0, le=200)] = 50,
+):
+    """
+    Get the conversation with a user in both directions, newest message first.
+
+    Args:
+        recipient_id (UUID4): The ID of the other user.
+        before (UUID | None): next_before of the previous page.
+        limit (int): The maximum number of messages per page.
+
+    Returns:
+        MessagePage: The messages and the cursor of the next page.
+    """
+    return await message_service.get_messages(
+        sender_id=current_user.id, recipient_id=recipient_id, before=before, limit=limit
+    )
+
+
+@chat_router.post("/{recipient_id}/read", status_code=status.HTTP_204_NO_CONTENT)
+async def mark_conversation_read(
+        recipient_id: UUID4,
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        message_service: Annotated[MessageService, Depends()],
 ):
-    return await message_service.get_messages(sender_id=current_user.id, recipient_id=recipient_id)
+    """
+    Reset the unread count of the conversation with a user.
+    """
+    await message_service.mark_conversation_read(user_id=current_user.id, other_user_id=recipient_id)
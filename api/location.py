@@ -1,22 +1,135 @@
+from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, status, WebSocket, WebSocketException
+from fastapi import APIRouter, Depends, Header, Query, status, WebSocket, WebSocketException
 from fastapi.websockets import WebSocketDisconnect
 from pydantic import UUID4, ValidationError
 from sse_starlette import EventSourceResponse
 
 from app.friends.service import FriendshipService
 
-from app.location.schemas import LocationBase, LocationOut
+from app.location.codec import BINARY_SUBPROTOCOL, LocationFrame, decode_frames
+from app.location.schemas import (
+    BoundingBox,
+    LocationBase,
+    LocationOut,
+    LocationNearbyOut,
+    LocationHistoryPage,
+    LocationViewportOut
+)
+from app.location.repository import RedisStreamRepository
 from app.location.service import LocationService
 
-from core.exceptions import UsersNotFriends
+from core.config import settings
+from core.exceptions import InvalidBoundingBox, UsersNotFriends
 from core.fastapi.dependencies.permission import PermissionDependencyHTTP, IsAuthenticated, IsAdmin, \
     PermissionDependencyWebsocket
 from core.fastapi.schemas.current_user import CurrentUser
 
 location_router = APIRouter(prefix="/location", tags=["Location"])
 
+HISTORY_DEFAULT_PERIOD = timedelta(hours=1)
+
+
+@location_router.get(
+    "/nearby",
+    response_model=list[LocationNearbyOut],
+    status_code=status.HTTP_200_OK,
+)
+async def get_nearby_friends_locations(
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        location_service: Annotated[LocationService, Depends()],
+        friendship_service: Annotated[FriendshipService, Depends()],
+        radius: Annotated[float, Query(gt=0, le=settings.location_nearby_max_radius)] = 1000,
+        longitude: Annotated[float | None, Query(ge=-180, le=180)] = None,
+        latitude: Annotated[float | None, Query(ge=-85.05112878, le=85.05112878)] = None,
+):
+    """
+    Get the accepted friends within a radius, nearest first.
+
+    The centre defaults to the last known location of the current user.
+
+    Args:
+        radius (float): The radius in meters.
+        longitude (float | None): Longitude of the centre.
+        latitude (float | None): Latitude of the centre.
+
+    Returns:
+        list[LocationNearbyOut]: Locations of the friends with their distance in meters.
+    """
+    friends_ids = await friendship_service.get_friend_ids(user_id=str(current_user.id))
+
+    return await location_service.get_nearby_friends_locations(
+        user_id=current_user.id,
+        friends_ids=friends_ids,
+        radius=radius,
+        longitude=longitude,
+        latitude=latitude
+    )
+
+
+@location_router.get(
+    "/viewport",
+    response_model=LocationViewportOut,
+    status_code=status.HTTP_200_OK,
+)
+async def get_friends_locations_in_viewport(
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        location_service: Annotated[LocationService, Depends()],
+        friendship_service: Annotated[FriendshipService, Depends()],
+        bbox: str,
+        zoom: Annotated[int, Query(ge=0, le=22)],
+):
+    """
+    Get the accepted friends inside a map viewport, clustered at low zoom.
+
+    Args:
+        bbox (str): The viewport as min_longitude,min_latitude,max_longitude,max_latitude.
+        zoom (int): The web map zoom level.
+
+    Returns:
+        LocationViewportOut: Clusters with their count and centroid, or the locations at high zoom.
+    """
+    try:
+        viewport = BoundingBox.from_query(bbox)
+    except ValueError:
+        raise InvalidBoundingBox()
+
+    friends_ids = await friendship_service.get_friend_ids(user_id=str(current_user.id))
+
+    return await location_service.get_friends_locations_in_viewport(
+        friends_ids=friends_ids, bbox=viewport, zoom=zoom
+    )
+
+
+@location_router.get("/stream")
+async def friends_locations_stream(
+        location_service: Annotated[LocationService, Depends()],
+        friendship_service: Annotated[FriendshipService, Depends()],
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+):
+    """
+    Stream the location updates of all the accepted friends of the current user.
+
+    The stream starts with the last known location of every friend.
+    """
+    async def casting():
+        async for change in location_service.subscribe_friends_locations(
+                user_id=current_user.id, friendship_service=friendship_service
+        ):
+            yield {
+                "event": "new_location",
+                "data": change
+            }
+
+    return EventSourceResponse(casting(), media_type="text/event-stream")
+
 
 @location_router.get(
     "/{user_id}",
@@ -38,6 +151,46 @@ async def get_user_location(
     return location
 
 
+@location_router.get(
+    "/{user_id}/history",
+    response_model=LocationHistoryPage,
+    status_code=status.HTTP_200_OK,
+)
+async def get_user_location_history(
+        user_id: UUID4,
+        current_user: Annotated[CurrentUser, Depends(
+            PermissionDependencyHTTP([IsAuthenticated], all_required=True)
+        )],
+        location_service: Annotated[LocationService, Depends()],
+        since: datetime | None = None,
+        cursor: datetime | None = None,
+        limit: Annotated[int, Query(gt=0, le=5000)] = 500,
+):
+    """
+    Get the points sent by a user, oldest first.
+
+    Pages are chained by passing the returned next_cursor as cursor. The same cursor can be
+    used to poll for points recorded after the last page.
+
+    Args:
+        user_id (UUID4): The ID of the user, must be the current user or one of their friends.
+        since (datetime | None): Earliest point to return, defaults to one hour ago.
+        cursor (datetime | None): next_cursor of the previous page.
+        limit (int): The maximum number of points per page.
+
+    Returns:
+        LocationHistoryPage: The points and the cursor of the next page.
+    """
+    if current_user.id != user_id and \
+            not await FriendshipService().is_users_friends(user_id=current_user.id, friend_id=user_id):
+        raise UsersNotFriends()
+
+    if since is None:
+        since = datetime.now(timezone.utc) - HISTORY_DEFAULT_PERIOD
+
+    return await location_service.get_location_history(user_id=user_id, since=since, cursor=cursor, limit=limit)
+
+
 @location_router.post(
     "/",
     response_model=LocationOut,
@@ -59,16 +212,31 @@ async def publish_live_location(
         location_service: Annotated[LocationService, Depends()],
         current_user: Annotated[CurrentUser, Depends(PermissionDependencyWebsocket([IsAuthenticated]))],
 ):
-    await websocket.accept()
+    """
+    Receive the live location of the current user.
+
+    Clients send JSON points by default. Clients requesting the binary subprotocol send frames of
+    little-endian latitude, longitude, unix timestamp (float64) and accuracy in meters (float32),
+    several frames may be concatenated in one message, oldest first.
+    """
+    binary = BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
     try:
         while True:
-            location = await websocket.receive_json()
-            location_serialised = LocationBase(**location)
-            await location_service.publish_location(location=location_serialised, user_id=current_user.id)
+            if binary:
+                locations = decode_frames(await websocket.receive_bytes())
+            else:
+                location = await websocket.receive_json()
+                # clients sending from a buffer may batch several points, oldest first
+                points = location if isinstance(location, list) else [location]
+                locations = [LocationFrame.from_location(LocationBase(**point)) for point in points]
+            await location_service.publish_locations(locations=locations, user_id=current_user.id)
     except WebSocketDisconnect as e:
         pass
-    except ValidationError:
+    except (ValidationError, ValueError):
         await websocket.send_json({"message": "Invalid location data", "type": "error"})
+    finally:
+        location_service.stop_publishing(user_id=current_user.id)
 
 
 @location_router.get("/stream/{user_id}")
@@ -77,14 +245,33 @@ async def message_stream(
         current_user: Annotated[CurrentUser, Depends(
             PermissionDependencyHTTP([IsAuthenticated], all_required=True)
         )],
-        user_id: UUID4
+        user_id: UUID4,
+        last_event_id: Annotated[str | None, Header()] = None,
 ):
+    """
+    Stream the location updates of a friend.
+
+    Every event carries the id of the update in the Redis stream of the user. A client reconnecting
+    with Last-Event-ID receives the updates it missed that are still kept, then the live ones.
+    """
+    if not await FriendshipService().is_users_friends(user_id=current_user.id, friend_id=user_id):
+        raise UsersNotFriends()
+
+    if last_event_id is not None:
+        try:
+            RedisStreamRepository.parse_id(last_event_id)
+        except ValueError:
+            # not an id issued by this endpoint, start from the live updates
+            last_event_id = None
+
     async def casting():
-        async for change in location_service.subscribe_location_with_user_id(user_id=str(user_id)):
-            if change:
-                yield {
-                    "event": "new_message",
-                    "data": change
-                }
+        async for event_id, change in location_service.subscribe_location_with_user_id(
+                user_id=str(user_id), last_event_id=last_event_id
+        ):
+            yield {
+                "id": event_id,
+                "event": "new_message",
+                "data": change
+            }
 
     return EventSourceResponse(casting(), media_type="text/event-stream")
@@ -1,9 +1,9 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Query, status
 from pydantic import UUID4
 
-from app.user.schemas import UserCreate, UserOut, UserUpdate
+from app.user.schemas import UserCreate, UserOut, UserPage, UserUpdate
 from app.user.service import UserService
 
 from core import exceptions
@@ -16,23 +16,30 @@ users_router = APIRouter(prefix="/users", tags=["Users"])
 
 @users_router.get(
     "/",
-    response_model=list[UserOut],
+    response_model=UserPage,
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(PermissionDependencyHTTP([IsAuthenticated]))]
 )
-async def get_all_users(user_service: Annotated[UserService, Depends()]):
+async def get_all_users(
+        user_service: Annotated[UserService, Depends()],
+        after_id: UUID4 | None = None,
+        limit: Annotated[int, Query(gt=0, le=200)] = 50
+):
     """
-    Get all users.
+    Get a page of users.
 
-    This endpoint retrieves all users from the database.
+    This endpoint retrieves users ordered by ID. Pages are chained by passing the returned
+    next_after_id as after_id.
 
     Args:
         user_service (UserService): User Service instance.
+        after_id (UUID4 | None): next_after_id of the previous page.
+        limit (int): The maximum number of users per page.
 
     Returns:
-        list[UserOut]: A list of all users in the database.
+        UserPage: The users and the cursor of the next page.
     """
-    users = await user_service.get_all_users()
+    users = await user_service.get_all_users(after_id=after_id, limit=limit)
     return users
 
 
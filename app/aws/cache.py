@@ -0,0 +1,128 @@
+import time
+from collections import OrderedDict
+
+from loguru import logger
+from prometheus_client import Counter
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.redis.session import get_redis_connection
+
+cache_hits = Counter("aws_presigned_url_cache_hits_total", "Presigned URLs served from a cache", ["tier"])
+cache_misses = Counter("aws_presigned_url_cache_misses_total", "Presigned URLs that had to be signed")
+
+
+class PresignedUrlCache:
+    """
+    Presigned URLs by S3 object, in an in-process LRU backed by an optional Redis cache.
+
+    A URL is handed out until margin seconds before it expires, so a client always gets a URL valid
+    for at least that long. URLs signed by another process are found in Redis and copied to the LRU
+    with the expiry left. Redis being unavailable only costs signing the URLs again.
+
+    Attributes:
+        max_size (int): URLs kept in the LRU.
+        margin (int): Seconds before the expiry of a URL it is no longer handed out.
+        redis_connection (Redis | None): Redis client, None to only cache in memory.
+    """
+
+    key_prefix = "presigned_url"
+
+    def __init__(self, max_size: int, margin: int, redis_connection: Redis | None):
+        self.max_size = max_size
+        self.margin = margin
+        self.redis_connection = redis_connection
+        # key -> (url, time after which it is no longer handed out)
+        self._urls: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    def get_key(self, bucket_name: str, object_name: str) -> str:
+        return f"{self.key_prefix}:{bucket_name}:{object_name}"
+
+    async def get_many(self, bucket_name: str, object_names: list[str]) -> dict[str, str]:
+        """
+        Retrieve the cached URLs of objects, reading Redis once for all the objects missing in memory.
+
+        Args:
+            bucket_name (str): The name of the S3 bucket.
+            object_names (list[str]): The names of the S3 objects.
+
+        Returns:
+            dict[str, str]: The URLs found, by object name.
+        """
+        now = time.time()
+        object_names = list(dict.fromkeys(object_names))
+        urls = {}
+        missing = []
+        for object_name in object_names:
+            key = self.get_key(bucket_name, object_name)
+            entry = self._urls.get(key)
+            if entry is not None and entry[1] > now:
+                self._urls.move_to_end(key)
+                urls[object_name] = entry[0]
+            else:
+                missing.append(object_name)
+        cache_hits.labels(tier="memory").inc(len(urls))
+
+        if missing and self.redis_connection is not None:
+            try:
+                async with self.redis_connection.pipeline(transaction=False) as pipe:
+                    for object_name in missing:
+                        key = self.get_key(bucket_name, object_name)
+                        pipe.get(key)
+                        pipe.pttl(key)
+                    results = await pipe.execute()
+            except RedisError as e:
+                logger.warning(f"Presigned URL cache could not be read from Redis: {e}")
+                results = [None, -2] * len(missing)
+
+            found = 0
+            for object_name, url, ttl in zip(missing, results[::2], results[1::2]):
+                if url is None or ttl <= 0:
+                    continue
+                urls[object_name] = url.decode()
+                self._put(self.get_key(bucket_name, object_name), urls[object_name], now + ttl / 1000)
+                found += 1
+            cache_hits.labels(tier="redis").inc(found)
+
+        cache_misses.inc(len(object_names) - len(urls))
+        return urls
+
+    async def set_many(self, bucket_name: str, urls: dict[str, str], expires_in: int) -> None:
+        """
+        Cache newly signed URLs.
+
+        Args:
+            bucket_name (str): The name of the S3 bucket.
+            urls (dict[str, str]): The URLs, by object name.
+            expires_in (int): Seconds the URLs are valid for.
+        """
+        ttl = expires_in - self.margin
+        if ttl <= 0 or not urls:
+            return
+
+        handed_out_until = time.time() + ttl
+        for object_name, url in urls.items():
+            self._put(self.get_key(bucket_name, object_name), url, handed_out_until)
+
+        if self.redis_connection is not None:
+            try:
+                async with self.redis_connection.pipeline(transaction=False) as pipe:
+                    for object_name, url in urls.items():
+                        pipe.set(self.get_key(bucket_name, object_name), url, ex=ttl)
+                    await pipe.execute()
+            except RedisError as e:
+                logger.warning(f"Presigned URL cache could not be written to Redis: {e}")
+
+    def _put(self, key: str, url: str, handed_out_until: float) -> None:
+        self._urls[key] = (url, handed_out_until)
+        self._urls.move_to_end(key)
+        while len(self._urls) > self.max_size:
+            self._urls.popitem(last=False)
+
+
+presigned_url_cache = PresignedUrlCache(
+    max_size=settings.aws_presigned_url_cache_size,
+    margin=settings.aws_presigned_url_cache_margin,
+    redis_connection=get_redis_connection() if settings.aws_presigned_url_cache_redis else None
+)
@@ -1,11 +1,16 @@
 import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator
 from loguru import logger
 
 import aioboto3
+from aiobotocore.client import AioBaseClient
 from fastapi import APIRouter, File
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from prometheus_client import Counter
 
+from app.aws.cache import presigned_url_cache
+from app.aws.signing import S3UrlSigner
 from core.config import settings
 
 router = APIRouter(tags=["Files"], prefix="/files")
@@ -16,6 +21,11 @@ MB = KB * 1024
 ALLOWED_FILE_TYPES = {"png", "jpg", "jpeg"}
 MAX_FILE_SIZE = MB * 3
 
+S3_REGION_NAME = 'eu-north-1'
+S3_ENDPOINT_URL = 'https://s3.eu-north-1.amazonaws.com'
+
+s3_clients_created = Counter("aws_s3_clients_created_total", "S3 clients created by AwsS3Service")
+
 
 # # singleton class for AWS services
 class AwsS3Service:
@@ -30,6 +40,9 @@ class AwsS3Service:
         __session (aioboto3.Session): An aioboto3 session for interacting with AWS services.
         __profile_bucket_name (str): The name of the bucket for profile images.
         __profile_default_image (str): The name of the default profile image.
+        __chat_archive_bucket_name (str): The name of the bucket for archived chat messages.
+        __s3 (AioBaseClient | None): The client shared by all requests, opened by start().
+        __signer (S3UrlSigner): Signs pre-signed URLs locally.
 
     """
     __instance = None
@@ -37,6 +50,10 @@ class AwsS3Service:
     __session: aioboto3.Session
     __profile_bucket_name: str
     __profile_default_image: str
+    __chat_archive_bucket_name: str
+    __s3: AioBaseClient | None = None
+    __exit_stack: AsyncExitStack | None = None
+    __signer: S3UrlSigner
 
     def __new__(cls):
         """
@@ -50,11 +67,35 @@ class AwsS3Service:
             AwsS3Service.__instance = super().__new__(cls)
             cls.__profile_bucket_name = settings.aws_s3_profile_image_bucket
             cls.__profile_default_image = settings.default_profile_image
-            cls.__session = aioboto3.Session(region_name='eu-north-1',
+            cls.__chat_archive_bucket_name = settings.aws_s3_chat_archive_bucket
+            cls.__session = aioboto3.Session(region_name=S3_REGION_NAME,
                                              aws_access_key_id=settings.aws_access_key,
                                              aws_secret_access_key=settings.aws_secret_access_key)
+            cls.__signer = S3UrlSigner(access_key=settings.aws_access_key,
+                                       secret_key=settings.aws_secret_access_key,
+                                       region_name=S3_REGION_NAME,
+                                       endpoint_url=S3_ENDPOINT_URL)
         return AwsS3Service.__instance
 
+    async def start(self) -> None:
+        """
+        Open the S3 client shared by all requests, instead of one client per request.
+
+        """
+        if self.__s3 is None:
+            exit_stack = AsyncExitStack()
+            self.__s3 = await exit_stack.enter_async_context(self.__client())
+            self.__exit_stack = exit_stack
+
+    async def stop(self) -> None:
+        """
+        Close the shared S3 client.
+
+        """
+        if self.__exit_stack is not None:
+            exit_stack, self.__exit_stack, self.__s3 = self.__exit_stack, None, None
+            await exit_stack.aclose()
+
     def __client(self):
         """
         Get an AWS S3 client.
@@ -63,9 +104,25 @@ class AwsS3Service:
             botocore.client.BaseClient: An AWS S3 client instance.
 
         """
+        s3_clients_created.inc()
         return self.__session.client(service_name="s3",
                                      config=Config(signature_version='s3v4'),
-                                     endpoint_url='https://s3.eu-north-1.amazonaws.com')
+                                     endpoint_url=S3_ENDPOINT_URL)
+
+    @asynccontextmanager
+    async def __s3_client(self) -> AsyncIterator[AioBaseClient]:
+        """
+        Use the shared S3 client, or a client of its own when the service was not started, e.g. in a Celery task.
+
+        Yields:
+            AioBaseClient: An AWS S3 client instance.
+
+        """
+        if self.__s3 is not None:
+            yield self.__s3
+        else:
+            async with self.__client() as s3:
+                yield s3
 
     async def generate_profile_presigned_url(self, object_name: str) -> str:
         """
@@ -78,7 +135,24 @@ class AwsS3Service:
             str: The pre-signed URL.
 
         """
-        return await self.__create_presigned_url(object_name, self.__profile_bucket_name)
+        urls = await self.generate_profile_presigned_urls([object_name])
+        return urls[object_name]
+
+    async def generate_profile_presigned_urls(self, object_names: list[str]) -> dict[str, str]:
+        """
+        Generate pre-signed URLs for accessing profile images.
+
+        URLs are reused from the presigned URL cache while they are valid long enough, the missing ones
+        are signed with a single client.
+
+        Args:
+            object_names (list[str]): The names of the S3 objects (files).
+
+        Returns:
+            dict[str, str]: The pre-signed URLs, by object name.
+
+        """
+        return await self.__get_presigned_urls(object_names, self.__profile_bucket_name)
 
     async def upload_profile_image(self, file_object: File, provided_filename: str) -> str:
         """
@@ -94,32 +168,76 @@ class AwsS3Service:
         """
         return await self.__upload_file_to_s3(file_object, provided_filename, self.__profile_bucket_name)
 
-    async def __create_presigned_url(self, object_name: str, bucket_name: str, expires_in: int = 3600) -> str:
+    async def upload_chat_archive(self, key: str, data: bytes) -> None:
         """
-        Create a pre-signed URL for accessing an S3 object.
+        Upload an archive blob of chat messages to AWS S3.
 
         Args:
-            object_name (str): The name of the S3 object.
+            key (str): The key of the blob.
+            data (bytes): The content of the blob.
+
+        """
+        async with self.__s3_client() as s3:
+            await s3.put_object(Bucket=self.__chat_archive_bucket_name, Key=key, Body=data)
+
+    async def download_chat_archive(self, key: str) -> bytes:
+        """
+        Download an archive blob of chat messages from AWS S3.
+
+        Args:
+            key (str): The key of the blob.
+
+        Returns:
+            bytes: The content of the blob.
+
+        """
+        async with self.__s3_client() as s3:
+            response = await s3.get_object(Bucket=self.__chat_archive_bucket_name, Key=key)
+            async with response["Body"] as stream:
+                return await stream.read()
+
+    async def __get_presigned_urls(self, object_names: list[str], bucket_name: str) -> dict[str, str]:
+        """
+        Get pre-signed URLs from the cache, signing and caching the missing ones.
+
+        Args:
+            object_names (list[str]): The names of the S3 objects.
             bucket_name (str): The name of the S3 bucket.
-            expires_in (int): The duration of validity for the URL.
 
         Returns:
-            str: The pre-signed URL.
+            dict[str, str]: The pre-signed URLs, by object name.
+
+        """
+        expires_in = settings.aws_presigned_url_expires_in
+        urls = await presigned_url_cache.get_many(bucket_name, object_names)
+        missing = [object_name for object_name in dict.fromkeys(object_names) if object_name not in urls]
+        if missing:
+            signed = self.__create_presigned_urls(missing, bucket_name, expires_in)
+            await presigned_url_cache.set_many(bucket_name, signed, expires_in)
+            urls.update(signed)
+        return urls
+
+    def __create_presigned_urls(self, object_names: list[str], bucket_name: str,
+                                expires_in: int = 3600) -> dict[str, str]:
+        """
+        Create pre-signed URLs for accessing S3 objects.
 
-        Raises:
-            ClientError: If an error occurs during URL generation.
+        Signing is a local computation over the credentials, so URLs are signed synchronously
+        without a client or any request to AWS.
+
+        Args:
+            object_names (list[str]): The names of the S3 objects.
+            bucket_name (str): The name of the S3 bucket.
+            expires_in (int): The duration of validity for the URLs.
+
+        Returns:
+            dict[str, str]: The pre-signed URLs, by object name.
 
         """
-        try:
-            async with self.__client() as s3:
-                url = await s3.generate_presigned_url('get_object',
-                                                      Params={'Bucket': bucket_name,
-                                                              'Key': object_name},
-                                                      ExpiresIn=expires_in)
-                return url
-        except ClientError as e:
-            logger.error(e)
-            raise ClientError
+        return {
+            object_name: self.__signer.generate_presigned_url(bucket_name, object_name, expires_in)
+            for object_name in object_names
+        }
 
     async def __upload_file_to_s3(self, file_object: File, provided_filename: str, bucket_name: str) -> str:
         """
@@ -135,7 +253,7 @@ class AwsS3Service:
 
         """
         new_filename = self.__generate_unique_filename(provided_filename)
-        async with self.__client() as s3:
+        async with self.__s3_client() as s3:
             await s3.upload_fileobj(file_object, bucket_name, new_filename)
         return new_filename
 
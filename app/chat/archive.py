@@ -0,0 +1,171 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from uuid import UUID
+
+import zstandard
+from loguru import logger
+from prometheus_client import Counter
+
+from app.aws.service import AwsS3Service
+from core.config import settings
+
+from .models import Message, MessageArchive
+from .repository import MessageArchiveRepository, MessageRepository, MessageSearchRepository
+from .schemas import MessageOut
+
+COMPRESSION_LEVEL = 10
+
+archived_messages = Counter("chat_archived_messages_total", "Messages moved to the archive")
+cache_hits = Counter("chat_archive_cache_hits_total", "Archive blobs read from memory")
+cache_misses = Counter("chat_archive_cache_misses_total", "Archive blobs downloaded and decoded")
+
+
+def encode_messages(messages: list[Message]) -> bytes:
+    """
+    Encode messages as zstd-compressed JSON lines, in the given order.
+    """
+    lines = b"".join(message.model_dump_json(exclude={"revision_id"}).encode() + b"\n" for message in messages)
+    return zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(lines)
+
+
+def decode_messages(data: bytes) -> list[MessageOut]:
+    lines = zstandard.ZstdDecompressor().decompress(data).splitlines()
+    return [MessageOut.model_validate_json(line) for line in lines]
+
+
+class LocalArchiveStorage:
+    """
+    Archive blobs stored as files under a directory, for development and single-host deployments.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    async def put(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self._write, key, data)
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread((self.path / key).read_bytes)
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self.path / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a blob is never seen half written
+        partial = path.with_name(f"{path.name}.partial")
+        partial.write_bytes(data)
+        partial.replace(path)
+
+
+class S3ArchiveStorage:
+    """
+    Archive blobs stored in the chat archive bucket.
+    """
+
+    def __init__(self):
+        self.aws_s3_service = AwsS3Service()
+
+    async def put(self, key: str, data: bytes) -> None:
+        await self.aws_s3_service.upload_chat_archive(key=key, data=data)
+
+    async def get(self, key: str) -> bytes:
+        return await self.aws_s3_service.download_chat_archive(key=key)
+
+
+def get_archive_storage() -> LocalArchiveStorage | S3ArchiveStorage:
+    if settings.chat_archive_storage == "s3":
+        return S3ArchiveStorage()
+    return LocalArchiveStorage(path=settings.chat_archive_path)
+
+
+class MessageArchiver:
+    """
+    Cold tier of the chat history.
+
+    Messages older than a cutoff are moved, per conversation and oldest first, into blobs of at most
+    chunk_size messages, newest first inside a blob. A blob is written and recorded before its
+    messages are deleted from MongoDB, and its key is derived from its oldest message, so a run
+    interrupted in between writes the same blob again on the next run instead of a duplicate.
+
+    Archived messages are removed from the search index, search only covers the hot messages.
+
+    Paging through an archived conversation reads the same blob for every page it spans, so the last
+    cache_size decoded blobs are kept in memory.
+    """
+
+    def __init__(self, storage: LocalArchiveStorage | S3ArchiveStorage, chunk_size: int, cache_size: int):
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        # (key, message count) -> messages, a blob rewritten by an interrupted run may have grown
+        self._cache: OrderedDict[tuple[str, int], list[MessageOut]] = OrderedDict()
+        self.message_repository = MessageRepository()
+        self.message_search_repository = MessageSearchRepository()
+        self.message_archive_repository = MessageArchiveRepository()
+
+    async def archive(self, created_before: datetime) -> int:
+        """
+        Move all the messages created before a date to the archive.
+
+        Returns:
+            int: The number of archived messages.
+        """
+        archived = 0
+        async for conversation_id in self.message_repository.find_conversation_ids(created_before=created_before):
+            archived += await self.archive_conversation(conversation_id=conversation_id, created_before=created_before)
+        return archived
+
+    async def archive_conversation(self, conversation_id: UUID, created_before: datetime) -> int:
+        archived = 0
+        while True:
+            messages = await self.message_repository.find_oldest_by_conversation_id(
+                conversation_id=conversation_id, created_before=created_before, limit=self.chunk_size
+            )
+            if not messages:
+                return archived
+
+            key = f"{conversation_id}/{messages[0].id}.jsonl.zst"
+            messages.reverse()
+            await self.storage.put(key, encode_messages(messages))
+
+            message_ids = [message.id for message in messages]
+            await self.message_archive_repository.add(MessageArchive(
+                conversation_id=conversation_id,
+                key=key,
+                message_count=len(messages),
+                oldest_created_at=messages[-1].created_at,
+                newest_created_at=messages[0].created_at,
+                message_ids=message_ids
+            ))
+            await self.message_search_repository.delete_by_message_ids(message_ids=message_ids)
+            await self.message_repository.delete_by_ids(message_ids=message_ids)
+
+            archived += len(messages)
+            archived_messages.inc(len(messages))
+            logger.info(f"Archived {len(messages)} messages of conversation {conversation_id} to {key}")
+
+    async def read(self, archive: MessageArchive) -> list[MessageOut]:
+        """
+        Read the messages of an archive blob, newest first.
+        """
+        cache_key = (archive.key, archive.message_count)
+        messages = self._cache.get(cache_key)
+        if messages is not None:
+            cache_hits.inc()
+            self._cache.move_to_end(cache_key)
+            return messages
+
+        cache_misses.inc()
+        messages = decode_messages(await self.storage.get(archive.key))
+        self._cache[cache_key] = messages
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return messages
+
+
+message_archiver = MessageArchiver(
+    storage=get_archive_storage(),
+    chunk_size=settings.chat_archive_chunk_size,
+    cache_size=settings.chat_archive_cache_size
+)
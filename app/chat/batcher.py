@@ -0,0 +1,188 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+
+from core.config import settings
+from core.exceptions import MessageNotSaved
+
+from .models import Message
+from .repository import DUPLICATE_KEY_ERROR, InboxRepository, MessageRepository, MessageSearchRepository
+
+INDEX_RETRY_DELAY = 1  # second, doubled after every failed attempt
+INDEX_MAX_ATTEMPTS = 5
+
+inserted_messages = Counter("chat_inserted_messages_total", "Messages written by the insert batcher")
+failed_messages = Counter("chat_failed_messages_total", "Messages the insert batcher could not write")
+batch_size = Histogram(
+    "chat_insert_batch_size",
+    "Messages written by a single insert_many",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+index_queue_depth = Gauge("chat_index_queue_depth", "Inserted batches waiting for their inbox and search updates")
+index_failed_messages = Counter(
+    "chat_index_failed_messages_total",
+    "Inserted messages missing from the inboxes or the search index after every retry",
+    ["index"]
+)
+
+
+class MessageInsertBatcher:
+    """
+    Group commit for chat messages.
+
+    Messages submitted within max_delay seconds of the first one of a batch are written together
+    with one unordered insert_many, at most max_concurrent_batches at once. A batch is written as soon
+    as it holds max_batch_size messages. Every caller waits for the outcome of its own message only.
+
+    The inboxes and the search index are updated afterwards by a single task, one inserted batch at a
+    time and in the order they were inserted, so an older batch can't overtake a newer one. A failed
+    update is retried with a growing delay instead of being dropped.
+
+    A message whose client_message_id was already used by its sender is not stored again, its caller
+    gets the message stored the first time.
+    """
+
+    def __init__(self, max_delay: float, max_batch_size: int, max_concurrent_batches: int):
+        self.max_delay = max_delay
+        self.max_batch_size = max_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.message_repository = MessageRepository()
+        self.inbox_repository = InboxRepository()
+        self.message_search_repository = MessageSearchRepository()
+        self._pending: list[tuple[Message, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._writes: set[asyncio.Task] = set()
+        self._inserts = asyncio.Semaphore(max_concurrent_batches)
+        self._index_queue: asyncio.Queue[list[Message]] = asyncio.Queue()
+        self._indexer: asyncio.Task | None = None
+
+        index_queue_depth.set_function(self._index_queue.qsize)
+
+    async def add(self, message: Message) -> Message:
+        """
+        Queue a message for the next batch and wait until it is written.
+
+        Raises:
+            MessageNotSaved: If the message was rejected by MongoDB.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((message, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    async def add_many(self, messages: list[Message]) -> list[Message]:
+        return list(await asyncio.gather(*[self.add(message) for message in messages]))
+
+    async def stop(self) -> None:
+        self._flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        if self._indexer is not None:
+            await self._index_queue.join()
+            self._indexer.cancel()
+            try:
+                await self._indexer
+            except asyncio.CancelledError:
+                pass
+            self._indexer = None
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: list[tuple[Message, asyncio.Future]]) -> None:
+        messages = [message for message, _ in batch]
+        batch_size.observe(len(messages))
+        try:
+            async with self._inserts:
+                errors = await self.message_repository.add_bulk(messages=messages)
+        except Exception as e:
+            logger.error(f"Insert of {len(messages)} messages failed: {e}")
+            failed_messages.inc(len(messages))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(MessageNotSaved())
+            return
+
+        inserted = [message for i, message in enumerate(messages) if i not in errors]
+        inserted_messages.inc(len(inserted))
+
+        for i, (message, future) in enumerate(batch):
+            # the caller may have gone away in the meantime
+            if i not in errors and not future.done():
+                future.set_result(message)
+
+        for i, error in errors.items():
+            message, future = batch[i]
+            stored = None
+            if error["code"] == DUPLICATE_KEY_ERROR and message.client_message_id is not None:
+                stored = await self._find_retried(message)
+            if future.done():
+                continue
+            if stored is not None:
+                future.set_result(stored)
+            else:
+                logger.error(f"Insert of message {message.id} failed: {error['errmsg']}")
+                failed_messages.inc()
+                future.set_exception(MessageNotSaved())
+
+        if inserted:
+            self._index_queue.put_nowait(inserted)
+            if self._indexer is None or self._indexer.done():
+                self._indexer = asyncio.create_task(self._index())
+
+    async def _find_retried(self, message: Message) -> Message | None:
+        try:
+            return await self.message_repository.find_by_client_message_id(
+                sender_id=message.sender_id, client_message_id=message.client_message_id
+            )
+        except Exception as e:
+            logger.error(f"Lookup of retried message {message.client_message_id} failed: {e}")
+            return None
+
+    async def _index(self) -> None:
+        while True:
+            messages = await self._index_queue.get()
+            try:
+                # the messages are stored, a failure only leaves the inbox previews or the search behind
+                await self._retry("inbox", self.inbox_repository.add_messages, messages)
+                await self._retry("search", self.message_search_repository.add_messages, messages)
+            finally:
+                self._index_queue.task_done()
+
+    async def _retry(self, index: str, update: Callable[..., Awaitable[None]], messages: list[Message]) -> None:
+        delay = INDEX_RETRY_DELAY
+        for attempt in range(1, INDEX_MAX_ATTEMPTS + 1):
+            try:
+                await update(messages=messages)
+                return
+            except Exception as e:
+                logger.error(f"Update of the {index} with {len(messages)} messages failed, attempt {attempt}: {e}")
+            if attempt < INDEX_MAX_ATTEMPTS:
+                await asyncio.sleep(delay)
+                delay *= 2
+        index_failed_messages.labels(index=index).inc(len(messages))
+
+
+message_insert_batcher = MessageInsertBatcher(
+    max_delay=settings.mongo_insert_batch_delay,
+    max_batch_size=settings.mongo_insert_batch_size,
+    max_concurrent_batches=settings.mongo_insert_max_concurrent_batches
+)
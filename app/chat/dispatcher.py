@@ -0,0 +1,171 @@
+import asyncio
+from collections import defaultdict
+from uuid import UUID
+
+from loguru import logger
+from prometheus_client import Counter, Gauge
+from pymongo.errors import OperationFailure, PyMongoError
+
+from core.config import settings
+
+from .repository import MessageRepository
+from .schemas import MessageOut
+
+RECONNECT_DELAY = 1  # second
+
+dispatched_messages = Counter(
+    "chat_stream_dispatched_messages_total",
+    "Inserted messages read from the change stream and routed to their recipient"
+)
+overflowed_subscriptions = Counter(
+    "chat_stream_overflowed_subscriptions_total",
+    "Subscriptions closed because their consumer could not keep up"
+)
+subscriptions_count = Gauge("chat_stream_subscriptions", "Open chat stream subscriptions of the worker")
+
+
+class MessageSubscription:
+    """
+    Messages addressed to one user with their resume token, consumed by a single SSE connection.
+
+    Chat messages can't be dropped like live locations, so a consumer filling its queue is closed
+    instead and the client has to reconnect.
+
+    Entering the subscription waits for the shared change stream to be open. start_token is then the
+    position of the stream when the subscription was added, every message after it is routed here.
+
+    Usage:
+        async with dispatcher.subscription(user_id) as subscription:
+            async for resume_token, message in subscription:
+                ...
+    """
+
+    def __init__(self, dispatcher: "MessageChangeStreamDispatcher", user_id: UUID, queue_size: int):
+        self.dispatcher = dispatcher
+        self.user_id = user_id
+        self.queue: asyncio.Queue[tuple[str, MessageOut] | None] = asyncio.Queue(maxsize=queue_size)
+        self.start_token: str | None = None
+
+    async def __aenter__(self) -> "MessageSubscription":
+        try:
+            await self.dispatcher.add(self)
+        except BaseException:
+            # __aexit__ is not called when entering fails or is cancelled
+            self.dispatcher.remove(self)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.dispatcher.remove(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple[str, MessageOut]:
+        item = await self.queue.get()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+    def put(self, resume_token: str, message: MessageOut) -> None:
+        if not self.queue.full():
+            self.queue.put_nowait((resume_token, message))
+            return
+
+        # the queue is full, replace its content with the end of stream marker
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+        self.dispatcher.remove(self)
+        overflowed_subscriptions.inc()
+
+
+class MessageChangeStreamDispatcher:
+    """
+    Shares one change stream of the messages collection between every chat subscription of the worker.
+
+    A single task watches the collection and routes each inserted message to the subscriptions of its
+    recipient, so the work per message does not grow with the number of connected users. The task is
+    started with the first subscription and resumes from the last seen token after a connection error.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscriptions: dict[UUID, set[MessageSubscription]] = defaultdict(set)
+        self.message_repository = MessageRepository()
+        self._resume_token: dict | None = None
+        self._watcher: asyncio.Task | None = None
+        self._opened = asyncio.Event()
+
+        subscriptions_count.set_function(
+            lambda: sum(len(subscribers) for subscribers in self._subscriptions.values())
+        )
+
+    def subscription(self, user_id: UUID) -> MessageSubscription:
+        return MessageSubscription(self, user_id, self.queue_size)
+
+    async def add(self, subscription: MessageSubscription) -> None:
+        """
+        Route the messages of a user to a subscription, once the change stream is open.
+        """
+        self._subscriptions[subscription.user_id].add(subscription)
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch())
+
+        # until the stream is open, messages inserted now would reach nobody
+        await self._opened.wait()
+        subscription.start_token = self._resume_token["_data"] if self._resume_token is not None else None
+
+    def remove(self, subscription: MessageSubscription) -> None:
+        subscribers = self._subscriptions.get(subscription.user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscriptions[subscription.user_id]
+
+    async def stop(self) -> None:
+        self._opened.clear()
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                async with self.message_repository.watch_inserts(resume_after=self._resume_token) as stream:
+                    if stream.resume_token is not None:
+                        self._resume_token = stream.resume_token
+                    self._opened.set()
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        try:
+                            self._dispatch(change)
+                        except Exception as e:
+                            # a malformed document must not stop the stream of every other message
+                            logger.error(f"Chat change {change.get('_id')} could not be dispatched: {e}")
+            except OperationFailure as e:
+                # most likely the token fell off the oplog, continue from the current position
+                logger.error(f"Chat change stream failed, not resuming: {e}")
+                self._resume_token = None
+            except PyMongoError as e:
+                logger.error(f"Chat change stream interrupted: {e}")
+            self._opened.clear()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _dispatch(self, change: dict) -> None:
+        subscribers = self._subscriptions.get(change["fullDocument"]["recipient_id"])
+        dispatched_messages.inc()
+        if not subscribers:
+            return
+
+        message = MessageOut.model_validate(change["fullDocument"])
+        for subscription in list(subscribers):
+            subscription.put(change["_id"]["_data"], message)
+
+
+message_change_stream_dispatcher = MessageChangeStreamDispatcher(queue_size=settings.mongo_stream_queue_size)
@@ -1,19 +1,132 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Annotated
-from uuid import UUID, uuid4
+from uuid import UUID, uuid5
 
 from beanie import Document
-from pydantic import Field
+from pydantic import Field, model_validator
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
 
 from core.config import settings
+from core.utils.ids import uuid7
+
+CONVERSATION_NAMESPACE = UUID("6f1c2b9e-3d4a-4e8b-9a57-2c0d8e1f4b63")
+
+
+def get_conversation_id(user_id: UUID | str, other_user_id: UUID | str) -> UUID:
+    """
+    ID of the conversation between two users, the same whichever of them is the sender.
+    """
+    first, second = sorted((str(user_id), str(other_user_id)))
+    return uuid5(CONVERSATION_NAMESPACE, f"{first}:{second}")
 
 
 class Message(Document):
-    id: UUID = Field(default_factory=uuid4)
+    # time-ordered, so new messages are appended to the right edge of the _id index
+    id: UUID = Field(default_factory=uuid7)
     recipient_id: UUID = Field(...)
     sender_id: UUID = Field(...)
+    # derived from sender_id and recipient_id
+    conversation_id: UUID = None
     content: str
-    created_at: Annotated[datetime, Field(default=datetime.now(), Literal=True)]
+    # set by clients to retry sending without creating duplicates
+    client_message_id: str | None = None
+    created_at: Annotated[datetime, Field(default_factory=lambda: datetime.now(timezone.utc))]
+
+    @model_validator(mode="before")
+    @classmethod
+    def set_conversation_id(cls, data):
+        if isinstance(data, dict) and data.get("conversation_id") is None:
+            data = {**data, "conversation_id": get_conversation_id(data["sender_id"], data["recipient_id"])}
+        return data
 
     class Settings:
         collection = settings.mongo_messages_collection_name
+        indexes = [
+            # history of a conversation, newest first
+            IndexModel(
+                [("conversation_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                name="conversation_id_created_at_id"
+            ),
+            IndexModel(
+                [("sender_id", ASCENDING), ("client_message_id", ASCENDING)],
+                unique=True,
+                partialFilterExpression={"client_message_id": {"$type": "string"}},
+                name="sender_id_client_message_id"
+            ),
+        ]
+
+
+class Inbox(Document):
+    """
+    One conversation of a user as listed in their inbox, updated on every message of the conversation.
+    """
+    user_id: UUID = Field(...)
+    conversation_id: UUID = Field(...)
+    other_user_id: UUID = Field(...)
+    last_message_id: UUID
+    last_sender_id: UUID
+    last_message_preview: str
+    last_message_at: datetime
+    unread_count: int = 0
+
+    class Settings:
+        collection = settings.mongo_inbox_collection_name
+        indexes = [
+            IndexModel([("user_id", ASCENDING), ("conversation_id", ASCENDING)], unique=True, name="user_id_conversation_id"),
+            # conversations of a user, most recent first
+            IndexModel(
+                [("user_id", ASCENDING), ("last_message_at", DESCENDING), ("conversation_id", DESCENDING)],
+                name="user_id_last_message_at_conversation_id"
+            ),
+        ]
+
+
+class MessageSearch(Document):
+    """
+    Copy of a message kept for full-text search, one per participant of the message.
+
+    A text index can't be prefixed by an array of participants, so every message is stored once
+    for its sender and once for its recipient. Searches only read the entries of one owner.
+    """
+    owner_id: UUID = Field(...)
+    message_id: UUID = Field(...)
+    content: str
+
+    class Settings:
+        collection = settings.mongo_message_search_collection_name
+        indexes = [
+            # no language, so words are matched as written whatever the language of the chat
+            IndexModel(
+                [("owner_id", ASCENDING), ("content", TEXT)],
+                default_language="none",
+                name="owner_id_content_text"
+            ),
+            # one entry per owner, also serves deleting the entries of archived messages
+            IndexModel([("message_id", ASCENDING), ("owner_id", ASCENDING)], unique=True, name="message_id_owner_id"),
+        ]
+
+
+class MessageArchive(Document):
+    """
+    Archive blob holding old messages of a conversation, moved out of the messages' collection.
+
+    The blobs of a conversation don't overlap, so they are read newest first like the conversation itself.
+    The IDs of the archived messages are kept to find the blob a page continues from.
+    """
+    conversation_id: UUID = Field(...)
+    key: str
+    message_count: int
+    oldest_created_at: datetime
+    newest_created_at: datetime
+    message_ids: list[UUID]
+
+    class Settings:
+        collection = settings.mongo_message_archive_collection_name
+        indexes = [
+            IndexModel([("key", ASCENDING)], unique=True, name="key"),
+            IndexModel(
+                [("conversation_id", ASCENDING), ("newest_created_at", DESCENDING), ("_id", DESCENDING)],
+                name="conversation_id_newest_created_at_id"
+            ),
+            IndexModel([("message_ids", ASCENDING)], name="message_ids"),
+        ]
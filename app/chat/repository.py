@@ -1,9 +1,19 @@
-from typing import List
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List
+from uuid import UUID
 
+from motor.motor_asyncio import AsyncIOMotorChangeStream
 from pydantic import UUID4
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from core.utils.ids import uuid7_lower_bound
 
 from . import schemas
-from .models import Message
+from .models import Inbox, Message, MessageArchive, MessageSearch, get_conversation_id
+
+DUPLICATE_KEY_ERROR = 11000
 
 
 class MessageRepository:
@@ -15,7 +25,7 @@ class MessageRepository:
         Retrieve a message from the messages' collection.
 
         Args:
-            message_id (UUID4): ID of the message.
+            message_id (UUID): ID of the message.
 
         Returns:
             Dict: Dictionary containing the message data.
@@ -24,24 +34,31 @@ class MessageRepository:
         return await cls.model.find_one({'_id': message_id})
 
     @classmethod
-    async def find_by_sender_id_recipient_id(cls, sender_id: UUID4, recipient_id: UUID4) -> list[Message]:
+    async def find_by_conversation_id(cls, conversation_id: UUID, before: Message | None, limit: int) -> list[Message]:
         """
-        Retrieve messages between sender and recipient from the messages' collection.
+        Retrieve a page of a conversation in both directions, newest first.
+
+        The page is read from the (conversation_id, created_at, _id) index, starting after the
+        before message, so its cost does not depend on the length of the conversation.
 
         Args:
-            sender_id (UUID4): ID of the sender user.
-            recipient_id (UUID4): ID of the recipient user.
+            conversation_id (UUID): ID of the conversation.
+            before (Message | None): The oldest message of the previous page.
+            limit (int): The maximum number of messages.
 
         Returns:
-            List[Dict]: List of message dictionaries.
+            list[Message]: The messages.
         """
+        query = {"conversation_id": conversation_id}
+        if before is not None:
+            query["$or"] = [
+                {"created_at": {"$lt": before.created_at}},
+                {"created_at": before.created_at, "_id": {"$lt": before.id}},
+            ]
 
-        messages = await cls.model.find(
-            Message.sender_id == sender_id,
-            Message.recipient_id == recipient_id
-        ).to_list()
-
-        return messages
+        return await cls.model.find(query).sort(
+            [("created_at", DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit).to_list()
 
     @classmethod
     async def add(cls, message: Message) -> Message:
@@ -54,3 +71,357 @@ class MessageRepository:
 
         new_message = await cls.model.insert_one(message)
         return new_message
+
+    @classmethod
+    async def find_by_client_message_id(cls, sender_id: UUID, client_message_id: str) -> Message | None:
+        return await cls.model.find_one({"sender_id": sender_id, "client_message_id": client_message_id})
+
+    @classmethod
+    async def find_by_ids(cls, message_ids: list[UUID]) -> list[Message]:
+        """
+        Retrieve messages in the order of their IDs.
+
+        Args:
+            message_ids (list[UUID]): IDs of the messages.
+
+        Returns:
+            list[Message]: The messages found.
+        """
+        messages = {message.id: message for message in await cls.model.find({"_id": {"$in": message_ids}}).to_list()}
+        return [messages[message_id] for message_id in message_ids if message_id in messages]
+
+    @classmethod
+    async def add_bulk(cls, messages: list[Message]) -> dict[int, dict]:
+        """
+        Insert messages into the messages' collection with a single unordered insert_many.
+
+        A message failing to insert does not prevent the others from being inserted.
+
+        Args:
+            messages (list[Message]): The messages to insert.
+
+        Returns:
+            dict[int, dict]: Write error of every message that was not inserted, by position in messages.
+        """
+        try:
+            await cls.model.insert_many(messages, ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error for error in e.details["writeErrors"]}
+        return {}
+
+    @classmethod
+    async def find_conversation_ids(cls, created_before: datetime) -> AsyncIterator[UUID]:
+        """
+        Stream the IDs of the conversations having messages created before a date.
+
+        The IDs are grouped by an aggregation read through a cursor, so neither the server nor the
+        caller holds them all in a single document or list, unlike distinct.
+        """
+        cursor = cls.model.get_motor_collection().aggregate([
+            {"$match": {"created_at": {"$lt": created_before}}},
+            {"$group": {"_id": "$conversation_id"}},
+        ], allowDiskUse=True)
+        async for document in cursor:
+            yield document["_id"]
+
+    @classmethod
+    async def find_oldest_by_conversation_id(
+            cls, conversation_id: UUID, created_before: datetime, limit: int
+    ) -> list[Message]:
+        """
+        Retrieve the oldest messages of a conversation created before a date, oldest first.
+
+        Args:
+            conversation_id (UUID): ID of the conversation.
+            created_before (datetime): Only messages created before this date are returned.
+            limit (int): The maximum number of messages.
+
+        Returns:
+            list[Message]: The messages.
+        """
+        return await cls.model.find(
+            {"conversation_id": conversation_id, "created_at": {"$lt": created_before}}
+        ).sort([("created_at", ASCENDING), ("_id", ASCENDING)]).limit(limit).to_list()
+
+    @classmethod
+    async def delete_by_ids(cls, message_ids: list[UUID]) -> None:
+        await cls.model.get_motor_collection().delete_many({"_id": {"$in": message_ids}})
+
+    @classmethod
+    def watch_inserts(cls, recipient_id: UUID4 | None = None, resume_after: dict | None = None) -> AsyncIOMotorChangeStream:
+        """
+        Open a change stream of the messages inserted into the messages' collection.
+
+        Filtering and projection run in MongoDB, so only new messages are sent over the wire
+        without the change metadata, except the resume token.
+
+        Args:
+            recipient_id (UUID4 | None): Only stream the messages sent to this user.
+            resume_after (dict | None): Resume token to start after.
+
+        Returns:
+            AsyncIOMotorChangeStream: The change stream, to be used as an async context manager.
+        """
+        match = {"operationType": "insert"}
+        if recipient_id is not None:
+            match["fullDocument.recipient_id"] = recipient_id
+
+        pipeline = [
+            {"$match": match},
+            {"$project": {"operationType": 1, "fullDocument": 1}},
+        ]
+        return cls.model.get_motor_collection().watch(pipeline=pipeline, resume_after=resume_after)
+
+    @classmethod
+    async def set_missing_conversation_ids(cls, batch_size: int = 1000) -> int:
+        """
+        Set the conversation_id of the messages stored before it was introduced.
+
+        The messages without one are found through the conversation index, so once they are all
+        migrated the call is a single empty index lookup.
+
+        Returns:
+            int: The number of updated messages.
+        """
+        collection = cls.model.get_motor_collection()
+        updated = 0
+        while True:
+            documents = await collection.find(
+                {"conversation_id": None}, {"sender_id": 1, "recipient_id": 1}
+            ).limit(batch_size).to_list(length=batch_size)
+            if not documents:
+                return updated
+
+            await collection.bulk_write([
+                UpdateOne(
+                    {"_id": document["_id"]},
+                    {"$set": {"conversation_id": get_conversation_id(document["sender_id"], document["recipient_id"])}}
+                )
+                for document in documents
+            ], ordered=False)
+            updated += len(documents)
+
+
+class InboxRepository:
+    model = Inbox
+    preview_length = 100  # characters of the last message kept in the inbox
+
+    @classmethod
+    async def add_message(cls, message: Message) -> None:
+        await cls.add_messages(messages=[message])
+
+    @classmethod
+    async def add_messages(cls, messages: list[Message]) -> None:
+        """
+        Record messages in the inboxes of their senders and recipients.
+
+        The messages are collapsed per inbox entry first, so every entry touched by the batch is upserted
+        once with its latest message and the number of messages it received. All the upserts are sent in
+        one round trip and each of them is atomic. Batches may be written out of order, so the last
+        message of an entry is only replaced by a newer one, compared by (created_at, id).
+
+        Args:
+            messages (list[Message]): The inserted messages, oldest first.
+        """
+        entries = {}
+        for message in messages:
+            last_message = {
+                "last_message_id": message.id,
+                "last_sender_id": message.sender_id,
+                "last_message_preview": message.content[:cls.preview_length],
+                "last_message_at": message.created_at,
+            }
+            sender = entries.setdefault((message.sender_id, message.conversation_id), {"received": 0})
+            sender["last_message"] = last_message
+            sender["other_user_id"] = message.recipient_id
+            recipient = entries.setdefault((message.recipient_id, message.conversation_id), {"received": 0})
+            recipient["last_message"] = last_message
+            recipient["other_user_id"] = message.sender_id
+            recipient["received"] += 1
+
+        operations = []
+        for (user_id, conversation_id), entry in entries.items():
+            last_message = entry["last_message"]
+            # missing on insert, null sorts before any date
+            stored_at = {"$ifNull": ["$last_message_at", None]}
+            is_newer = {"$or": [
+                {"$lt": [stored_at, last_message["last_message_at"]]},
+                {"$and": [
+                    {"$eq": [stored_at, last_message["last_message_at"]]},
+                    {"$lt": ["$last_message_id", last_message["last_message_id"]]},
+                ]},
+            ]}
+            update = {
+                # literal, so a preview starting with $ is not read as a field path
+                field: {"$cond": [is_newer, {"$literal": value}, f"${field}"]}
+                for field, value in last_message.items()
+            }
+            update["other_user_id"] = {"$literal": entry["other_user_id"]}
+            update["unread_count"] = {"$add": [{"$ifNull": ["$unread_count", 0]}, entry["received"]]}
+            operations.append(
+                UpdateOne({"user_id": user_id, "conversation_id": conversation_id}, [{"$set": update}], upsert=True)
+            )
+
+        await cls.model.get_motor_collection().bulk_write(operations, ordered=False)
+
+    @classmethod
+    async def find_by_user_id(cls, user_id: UUID, before: datetime | None, before_conversation_id: UUID | None,
+                              limit: int) -> list[Inbox]:
+        """
+        Retrieve a page of the conversations of a user, most recent first.
+
+        Conversations are ordered by (last_message_at, conversation_id), read from the index of the
+        same keys, so conversations whose last messages share a timestamp are neither skipped nor
+        repeated across pages.
+
+        Args:
+            user_id (UUID): ID of the user.
+            before (datetime | None): last_message_at of the last conversation of the previous page.
+            before_conversation_id (UUID | None): conversation_id of the last conversation of the previous page.
+            limit (int): The maximum number of conversations.
+
+        Returns:
+            list[Inbox]: The conversations.
+        """
+        query = {"user_id": user_id}
+        if before is not None:
+            if before_conversation_id is None:
+                query["last_message_at"] = {"$lt": before}
+            else:
+                query["$or"] = [
+                    {"last_message_at": {"$lt": before}},
+                    {"last_message_at": before, "conversation_id": {"$lt": before_conversation_id}},
+                ]
+
+        return await cls.model.find(query).sort(
+            [("last_message_at", DESCENDING), ("conversation_id", DESCENDING)]
+        ).limit(limit).to_list()
+
+    @classmethod
+    async def mark_read(cls, user_id: UUID, conversation_id: UUID) -> None:
+        await cls.model.get_motor_collection().update_one(
+            {"user_id": user_id, "conversation_id": conversation_id},
+            {"$set": {"unread_count": 0}}
+        )
+
+
+class MessageSearchRepository:
+    model = MessageSearch
+    window = timedelta(days=30)  # first and shortest time window searched
+    max_windows = 4  # time windows searched before the rest of the history at once
+
+    @classmethod
+    async def add_messages(cls, messages: list[Message]) -> None:
+        """
+        Index messages for the search of their sender and of their recipient.
+
+        Messages already indexed are skipped, so a failed batch can be indexed again.
+
+        Args:
+            messages (list[Message]): The inserted messages.
+        """
+        try:
+            await cls.model.get_motor_collection().insert_many([
+                {"owner_id": owner_id, "message_id": message.id, "content": message.content}
+                for message in messages
+                for owner_id in (message.sender_id, message.recipient_id)
+            ], ordered=False)
+        except BulkWriteError as e:
+            if e.details["writeConcernErrors"] or any(
+                error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]
+            ):
+                raise
+
+    @classmethod
+    async def delete_by_message_ids(cls, message_ids: list[UUID]) -> None:
+        await cls.model.get_motor_collection().delete_many({"message_id": {"$in": message_ids}})
+
+    @classmethod
+    async def find_message_ids(cls, owner_id: UUID, query: str, before: UUID | None, limit: int) -> list[UUID]:
+        """
+        Search the messages sent or received by a user, newest first.
+
+        The text index is prefixed by owner_id, so only the entries of the user are searched. Its
+        matches come out in no useful order and have to be sorted by message ID, so they are
+        searched in time windows, newest first, each twice as long as the previous one. A common
+        word fills the page from the first window and only its recent matches are sorted, a rare
+        word has few matches to sort across all its windows. The oldest matches, past max_windows,
+        are searched at once. Message IDs are time-ordered and used as the cursor.
+
+        Args:
+            owner_id (UUID): ID of the user.
+            query (str): Words to search, a message matches if it contains any of them.
+            before (UUID | None): The ID of the last message of the previous page.
+            limit (int): The maximum number of messages.
+
+        Returns:
+            list[UUID]: IDs of the matching messages.
+        """
+        # milliseconds since the epoch in the first 48 bits of a UUIDv7
+        end = (before.int >> 80) / 1000 if before is not None else time.time()
+        upper = before
+        window = cls.window.total_seconds()
+        message_ids = []
+        for i in range(cls.max_windows + 1):
+            criteria = {"owner_id": owner_id, "$text": {"$search": query}}
+            bounds = {}
+            if upper is not None:
+                bounds["$lt"] = upper
+            lower = None
+            if i < cls.max_windows:
+                end -= window
+                window *= 2
+                lower = uuid7_lower_bound(end)
+                bounds["$gte"] = lower
+            if bounds:
+                criteria["message_id"] = bounds
+
+            cursor = cls.model.get_motor_collection().find(
+                criteria, {"_id": 0, "message_id": 1}
+            ).sort("message_id", DESCENDING).limit(limit - len(message_ids))
+            message_ids += [document["message_id"] async for document in cursor]
+            if len(message_ids) == limit or end <= 0:
+                break
+            upper = lower
+
+        return message_ids
+
+
+class MessageArchiveRepository:
+    model = MessageArchive
+
+    @classmethod
+    async def add(cls, archive: MessageArchive) -> None:
+        """
+        Record an archive blob, replacing the record of a blob written again with the same key.
+        """
+        await cls.model.get_motor_collection().replace_one(
+            {"key": archive.key}, archive.model_dump(exclude={"id", "revision_id"}), upsert=True
+        )
+
+    @classmethod
+    async def find_by_message_id(cls, conversation_id: UUID, message_id: UUID) -> MessageArchive | None:
+        return await cls.model.find_one({"conversation_id": conversation_id, "message_ids": message_id})
+
+    @classmethod
+    async def find_previous(cls, conversation_id: UUID, after: MessageArchive | None) -> MessageArchive | None:
+        """
+        Retrieve the archive blob of a conversation preceding another one.
+
+        Args:
+            conversation_id (UUID): ID of the conversation.
+            after (MessageArchive | None): The blob read last, None for the newest blob.
+
+        Returns:
+            MessageArchive | None: The blob, None when the start of the conversation was reached.
+        """
+        query = {"conversation_id": conversation_id}
+        if after is not None:
+            query["$or"] = [
+                {"newest_created_at": {"$lt": after.newest_created_at}},
+                {"newest_created_at": after.newest_created_at, "_id": {"$lt": after.id}},
+            ]
+
+        return await cls.model.find(query).sort(
+            [("newest_created_at", DESCENDING), ("_id", DESCENDING)]
+        ).first_or_none()
@@ -1,4 +1,6 @@
 from datetime import datetime
+from typing import Literal
+from uuid import UUID
 
 from pydantic import BaseModel, Field, UUID4
 
@@ -10,9 +12,11 @@ class MessageBase(BaseModel):
     Attributes:
         recipient_id (UUID4): The UUID of the message's recipient.
         content (str): The content of the message.
+        client_message_id (str | None): ID chosen by the client, sending it again returns the stored message.
     """
     recipient_id: UUID4
     content: str
+    client_message_id: str | None = Field(default=None, min_length=1, max_length=64)
 
 
 class MessageIn(MessageBase):
@@ -30,12 +34,12 @@ class MessageOut(MessageIn):
     Model for outgoing messages, including their MongoDB identifier.
 
     Attributes:
-        id (ObjectIdField): The MongoDB Object ID of the message.
+        id (UUID): The MongoDB ID of the message, a time-ordered UUIDv7.
         sender_id (UUID4): The UUID of the message's sender.
         date_created (datetime): The date and time when the message was created.
     """
     # alias for Mongo id
-    id: UUID4 = Field(alias="_id")
+    id: UUID = Field(alias="_id")
     created_at: datetime
 
     class Config:
@@ -47,3 +51,95 @@ class MessageOut(MessageIn):
         """
         # allows to populate model with field names instead of aliases
         populate_by_name = True
+
+
+class MessagePage(BaseModel):
+    """
+    Page of a conversation, newest message first.
+
+    Attributes:
+        items (list[MessageOut]): The messages.
+        next_before (UUID | None): Pass as before to get the previous messages.
+        has_more (bool): Whether older messages may exist.
+    """
+    items: list[MessageOut]
+    next_before: UUID | None
+    has_more: bool
+
+
+class InboxOut(BaseModel):
+    """
+    Model for a conversation listed in the inbox.
+
+    Attributes:
+        conversation_id (UUID): The ID of the conversation.
+        other_user_id (UUID): The UUID of the other participant.
+        last_message_id (UUID): The ID of the last message.
+        last_sender_id (UUID): The UUID of the sender of the last message.
+        last_message_preview (str): The beginning of the last message.
+        last_message_at (datetime): The date and time of the last message.
+        unread_count (int): The number of messages the user has not read.
+    """
+    conversation_id: UUID
+    other_user_id: UUID
+    last_message_id: UUID
+    last_sender_id: UUID
+    last_message_preview: str
+    last_message_at: datetime
+    unread_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class InboxPage(BaseModel):
+    """
+    Page of the inbox, most recent conversation first.
+
+    Attributes:
+        items (list[InboxOut]): The conversations.
+        next_before (datetime | None): Pass as before to get the older conversations.
+        next_before_conversation_id (UUID | None): Pass as before_conversation_id with next_before.
+        has_more (bool): Whether older conversations may exist.
+    """
+    items: list[InboxOut]
+    next_before: datetime | None
+    next_before_conversation_id: UUID | None
+    has_more: bool
+
+
+class ChatSocketMessageIn(MessageBase):
+    """
+    Model for a message sent over the chat websocket.
+
+    A socket can drop before the client gets the answer to a message, so the client must identify
+    every message and send the same client_message_id again when it retries.
+
+    Attributes:
+        type (str): Always "message".
+        client_message_id (str): ID chosen by the client, sending it again returns the stored message.
+    """
+    type: Literal["message"]
+    client_message_id: str = Field(min_length=1, max_length=64)
+
+
+class MessageAckIn(BaseModel):
+    """
+    Model for the acknowledgement of received messages, sent over the chat websocket by their recipient.
+
+    Attributes:
+        type (str): Whether the messages were delivered to a device or read by the user.
+        message_ids (list[UUID]): The IDs of the messages.
+    """
+    type: Literal["delivered", "read"]
+    message_ids: list[UUID] = Field(min_length=1, max_length=100)
+
+
+class MessageAckOut(MessageAckIn):
+    """
+    Model for the acknowledgement forwarded to the sender of the messages.
+
+    Attributes:
+        user_id (UUID): The UUID of the recipient acknowledging the messages.
+    """
+    user_id: UUID
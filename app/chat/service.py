@@ -1,34 +1,241 @@
-from typing import AsyncIterable
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterable, Literal
+from uuid import UUID
 
+from loguru import logger
 from pydantic import UUID4
+from pymongo.errors import OperationFailure
 
-from app.chat.models import Message
-from app.chat.repository import MessageRepository
-from app.chat.schemas import MessageOut, MessageIn
-from core.db.mongo_session import get_message_collection
+from app.chat.archive import message_archiver
+from app.chat.batcher import message_insert_batcher
+from app.chat.dispatcher import message_change_stream_dispatcher
+from app.chat.models import Message, MessageArchive, get_conversation_id
+from app.chat.repository import (
+    InboxRepository,
+    MessageArchiveRepository,
+    MessageRepository,
+    MessageSearchRepository
+)
+from app.chat.schemas import InboxPage, InboxOut, MessageAckOut, MessageOut, MessageIn, MessagePage
+from core.exceptions import MessageNotFound
+from core.redis.pubsub import pubsub_multiplexer
+from core.redis.session import get_redis_connection
+
+
+def get_chat_acks_channel(user_id: UUID4 | str) -> str:
+    """
+    Name of the Redis channel carrying the delivered and read acks of the messages sent by a user.
+    """
+    return f"channel:chat:acks:{user_id}"
 
 
 class MessageService:
     def __init__(self):
         self.message_repository = MessageRepository()
+        self.inbox_repository = InboxRepository()
+        self.message_search_repository = MessageSearchRepository()
+        self.message_archive_repository = MessageArchiveRepository()
+        self.redis_connection = get_redis_connection()
+
+    async def get_messages(
+            self,
+            sender_id: UUID4,
+            recipient_id: UUID4,
+            before: UUID | None = None,
+            limit: int = 50
+    ) -> MessagePage:
+        """
+        Retrieve a page of a conversation, newest first.
+
+        Once the messages in MongoDB are exhausted, the page continues with the archived messages
+        of the conversation, so clients page through the whole history with the same cursor.
+
+        Raises:
+            MessageNotFound: If the before message is not a message of the conversation.
+        """
+        conversation_id = get_conversation_id(sender_id, recipient_id)
+
+        before_message = None
+        before_archive = None
+        if before is not None:
+            before_message = await self.message_repository.find_by_id(message_id=before)
+            if before_message is None:
+                before_archive = await self.message_archive_repository.find_by_message_id(
+                    conversation_id=conversation_id, message_id=before
+                )
+                if before_archive is None:
+                    raise MessageNotFound()
+            elif before_message.conversation_id != conversation_id:
+                raise MessageNotFound()
+
+        items = []
+        if before_archive is None:
+            res = await self.message_repository.find_by_conversation_id(
+                conversation_id=conversation_id,
+                before=before_message,
+                limit=limit
+            )
+            items = [MessageOut.model_validate(message.__dict__) for message in res]
+
+        if len(items) < limit:
+            items += await self._get_archived_messages(
+                conversation_id=conversation_id, before=before, before_archive=before_archive, limit=limit - len(items)
+            )
 
-    async def get_messages(self, sender_id: UUID4, recipient_id: UUID4) -> list[MessageOut]:
-        res = await self.message_repository.find_by_sender_id_recipient_id(
-            sender_id=sender_id,
-            recipient_id=recipient_id,
+        return MessagePage(
+            items=items,
+            next_before=items[-1].id if items else None,
+            has_more=len(items) == limit
         )
 
-        return [MessageOut.model_validate(message.__dict__) for message in res]
+    async def _get_archived_messages(
+            self,
+            conversation_id: UUID,
+            before: UUID | None,
+            before_archive: MessageArchive | None,
+            limit: int
+    ) -> list[MessageOut]:
+        """
+        Read archived messages of a conversation, newest first.
+
+        Every message in the archive is older than the messages left in MongoDB, so a page continues
+        after the before message in its own blob, or from the newest blob when the before message is
+        not archived.
+        """
+        items = []
+        archive = before_archive
+        if archive is not None:
+            messages = await message_archiver.read(archive)
+            start = next(i for i, message in enumerate(messages) if message.id == before) + 1
+            items = messages[start:start + limit]
+
+        while len(items) < limit:
+            archive = await self.message_archive_repository.find_previous(conversation_id=conversation_id, after=archive)
+            if archive is None:
+                break
+            messages = await message_archiver.read(archive)
+            items += messages[:limit - len(items)]
+
+        return items
+
+    async def search_messages(
+            self,
+            user_id: UUID4,
+            query: str,
+            before: UUID | None = None,
+            limit: int = 50
+    ) -> MessagePage:
+        message_ids = await self.message_search_repository.find_message_ids(
+            owner_id=user_id, query=query, before=before, limit=limit
+        )
+        res = await self.message_repository.find_by_ids(message_ids=message_ids)
+
+        items = [MessageOut.model_validate(message.__dict__) for message in res]
+        return MessagePage(
+            items=items,
+            next_before=message_ids[-1] if message_ids else None,
+            has_more=len(message_ids) == limit
+        )
 
     async def send_message(self, message: MessageIn) -> MessageOut:
-        res = await self.message_repository.add(message=Message.model_validate(message.model_dump()))
+        res = await message_insert_batcher.add(message=Message.model_validate(message.model_dump()))
 
         return MessageOut.model_validate(res.__dict__)
 
-    async def subscribe_to_change_stream(self, user_id: UUID4) -> AsyncIterable[MessageOut]:
-        collection = await get_message_collection()
+    async def send_messages(self, messages: list[MessageIn]) -> list[MessageOut]:
+        res = await message_insert_batcher.add_many(
+            messages=[Message.model_validate(message.model_dump()) for message in messages]
+        )
+
+        return [MessageOut.model_validate(message.__dict__) for message in res]
+
+    async def get_inbox(self, user_id: UUID4, before: datetime | None = None,
+                        before_conversation_id: UUID | None = None, limit: int = 50) -> InboxPage:
+        res = await self.inbox_repository.find_by_user_id(
+            user_id=user_id, before=before, before_conversation_id=before_conversation_id, limit=limit
+        )
+
+        items = [InboxOut.model_validate(conversation) for conversation in res]
+        return InboxPage(
+            items=items,
+            next_before=items[-1].last_message_at if items else None,
+            next_before_conversation_id=items[-1].conversation_id if items else None,
+            has_more=len(items) == limit
+        )
+
+    async def mark_conversation_read(self, user_id: UUID4, other_user_id: UUID4) -> None:
+        await self.inbox_repository.mark_read(
+            user_id=user_id, conversation_id=get_conversation_id(user_id, other_user_id)
+        )
+
+    async def subscribe_to_change_stream(
+            self,
+            user_id: UUID4,
+            last_event_id: str | None = None
+    ) -> AsyncIterable[tuple[str, MessageOut]]:
+        """
+        Stream the messages sent to a user as (resume token, message) pairs.
+
+        When last_event_id is given, the messages inserted after that token are replayed first from a
+        change stream of the user resumed after it. The shared subscription is opened before, so
+        messages arriving during the replay are kept and the ones already replayed are skipped. The
+        replay only ends once it has read past the position the shared stream was at when the
+        subscription was added, so no message falls between the two.
+        """
+        async with message_change_stream_dispatcher.subscription(user_id=user_id) as subscription:
+            replayed = set()
+            if last_event_id is not None:
+                try:
+                    async with self.message_repository.watch_inserts(
+                            recipient_id=user_id, resume_after={"_data": last_event_id}
+                    ) as stream:
+                        while True:
+                            change = await stream.try_next()
+                            if change is None:
+                                # resume tokens of a collection sort in the order of their changes
+                                if subscription.start_token is None or \
+                                        stream.resume_token["_data"] >= subscription.start_token:
+                                    break
+                                continue
+                            message = MessageOut.model_validate(change["fullDocument"])
+                            replayed.add(message.id)
+                            yield change["_id"]["_data"], message
+                except OperationFailure as e:
+                    # invalid or expired token, only the live messages can be sent
+                    logger.warning(f"Chat stream of {user_id} could not resume after {last_event_id}: {e}")
+
+            async for resume_token, message in subscription:
+                if message.id in replayed:
+                    continue
+                yield resume_token, message
+
+    async def acknowledge_messages(
+            self,
+            user_id: UUID4,
+            message_ids: list[UUID],
+            status: Literal["delivered", "read"]
+    ) -> None:
+        """
+        Forward the acks of a recipient to the senders of the messages, wherever they are connected.
+
+        Messages not sent to the user are ignored. Reading messages also resets the unread count of
+        their conversations.
+        """
+        messages = await self.message_repository.find_by_ids(message_ids=message_ids)
+
+        message_ids_by_sender = defaultdict(list)
+        for message in messages:
+            if message.recipient_id == user_id:
+                message_ids_by_sender[message.sender_id].append(message.id)
+
+        for sender_id, sender_message_ids in message_ids_by_sender.items():
+            ack = MessageAckOut(type=status, message_ids=sender_message_ids, user_id=user_id)
+            await self.redis_connection.publish(get_chat_acks_channel(sender_id), ack.model_dump_json())
+            if status == "read":
+                await self.mark_conversation_read(user_id=user_id, other_user_id=sender_id)
 
-        async with collection.watch() as stream:
-            async for change in stream:
-                if change["fullDocument"]["recipient_id"] == user_id:
-                    yield MessageOut.model_validate(change["fullDocument"])
+    async def subscribe_to_acks(self, user_id: UUID4) -> AsyncIterable[str]:
+        async with pubsub_multiplexer.subscription(get_chat_acks_channel(user_id)) as subscription:
+            async for _, ack in subscription:
+                yield ack.decode()
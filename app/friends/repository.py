@@ -158,6 +158,31 @@ class FriendsRepository:
 
         return (await session.execute(stmt)).scalars().all()
 
+    @classmethod
+    async def find_friend_ids_by_user_id(cls, session: AsyncSession, user_id: str) -> Sequence[UUID4]:
+        """
+        Retrieve the IDs of the users who have an accepted friendship with the given user.
+
+        Unlike find_friends_by_user_id, this selects a single column and does not load the related users.
+
+        Args:
+            session (AsyncSession): The database session.
+            user_id (str): The unique identifier of the user.
+
+        Returns:
+            Sequence[UUID4]: The IDs of the user's friends.
+        """
+        stmt = select(
+            Friendship.addressee_id
+        ).filter(
+            and_(
+                Friendship.requester_id == user_id,
+                Friendship.status == "accepted"
+            )
+        )
+
+        return (await session.execute(stmt)).scalars().all()
+
     @classmethod
     async def find_sent_requests_by_user_id(
             cls,
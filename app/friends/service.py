@@ -1,3 +1,5 @@
+from pydantic import UUID4
+
 from core.db.session import async_session_factory, UnitOfWork
 from core.exceptions.friends import (
     AlreadySentRequest,
@@ -6,6 +8,7 @@ from core.exceptions.friends import (
     SameUser,
     FriendshipNotFound
 )
+from core.redis.session import get_redis_connection
 from app.user.models import User
 from app.user.service import UserService
 from .friendship_status_enum import FriendshipStatusEnum
@@ -14,28 +17,42 @@ from .models import Friendship
 from .schemas import FriendshipOut
 
 
+def get_friendships_channel(user_id: UUID4 | str) -> str:
+    """
+    Name of the Redis channel notified whenever the friends of a user change.
+    """
+    return f"channel:friendships:{user_id}"
+
+
 class FriendshipService:
     def __init__(self):
         self.friendship_repository = FriendsRepository()
         self.user_service = UserService()
+        self.redis_connection = get_redis_connection()
 
     async def get_friends(self, user_id: str) -> list[FriendshipOut]:
         async with UnitOfWork(async_session_factory()) as uow:
             res = await self.friendship_repository.find_friends_by_user_id(uow.session, user_id)
 
-        return [await self._construct_friendship(friendship) for friendship in res]
+        return await self._construct_friendships(res)
+
+    async def get_friend_ids(self, user_id: str) -> list[str]:
+        async with UnitOfWork(async_session_factory()) as uow:
+            res = await self.friendship_repository.find_friend_ids_by_user_id(uow.session, user_id)
+
+        return [str(friend_id) for friend_id in res]
 
     async def get_sent_friendship_requests(self, user_id: str):
         async with UnitOfWork(async_session_factory()) as uow:
             res = await self.friendship_repository.find_sent_requests_by_user_id(uow.session, user_id)
 
-        return [await self._construct_friendship(friendship) for friendship in res]
+        return await self._construct_friendships(res)
 
     async def get_received_friendship_requests(self, user_id: str):
         async with UnitOfWork(async_session_factory()) as uow:
             res = await self.friendship_repository.find_received_requests_by_user_id(uow.session, user_id)
 
-        return [await self._construct_friendship(friendship) for friendship in res]
+        return await self._construct_friendships(res)
 
     async def send_friend_request(self, user_id: str, friend_id: str) -> FriendshipOut:
         if user_id == friend_id:
@@ -77,6 +94,8 @@ class FriendshipService:
             await uow.commit()
             await uow.refresh(friendship)
 
+        await self._notify_friendship_changed(friendship)
+
         return await self._construct_friendship(friendship)
 
     async def delete_friendship(self, friendship_id: str) -> None:
@@ -98,8 +117,17 @@ class FriendshipService:
 
         return False
 
+    async def _notify_friendship_changed(self, friendship: Friendship) -> None:
+        for user_id in (friendship.requester_id, friendship.addressee_id):
+            await self.redis_connection.publish(get_friendships_channel(user_id), str(friendship.id))
+
     async def _construct_friendship(self, friendship: Friendship) -> FriendshipOut:
-        return FriendshipOut.model_validate({
-            **friendship.__dict__,
-            "user": await self.user_service.set_presigned_url_to_user(friendship.addressee)
-        })
+        friendships = await self._construct_friendships([friendship])
+        return friendships[0]
+
+    async def _construct_friendships(self, friendships: list[Friendship]) -> list[FriendshipOut]:
+        await self.user_service.set_presigned_url_to_users([friendship.addressee for friendship in friendships])
+        return [
+            FriendshipOut.model_validate({**friendship.__dict__, "user": friendship.addressee})
+            for friendship in friendships
+        ]
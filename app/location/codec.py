@@ -0,0 +1,75 @@
+import json
+import math
+import struct
+import time
+from typing import NamedTuple
+from uuid import UUID
+
+from . import schemas
+
+# websocket subprotocol a client requests to send binary frames instead of JSON
+BINARY_SUBPROTOCOL = "huchno.location.v1"
+
+# latitude, longitude, unix timestamp in seconds, accuracy in meters (NaN when unknown)
+FRAME = struct.Struct("<dddf")
+# what is published to Redis: the user id followed by the frame
+MESSAGE = struct.Struct("<16sdddf")
+
+MAX_LATITUDE = 85.05112878  # limit of the Redis GEO index
+
+
+class LocationFrame(NamedTuple):
+    latitude: float
+    longitude: float
+    timestamp: float
+    accuracy: float
+
+    @classmethod
+    def from_location(cls, location: schemas.LocationBase) -> "LocationFrame":
+        return cls(latitude=location.latitude, longitude=location.longitude, timestamp=time.time(), accuracy=math.nan)
+
+
+def decode_frames(data: bytes) -> list[LocationFrame]:
+    """
+    Decode a websocket message holding one or more frames, oldest first.
+
+    Raises:
+        ValueError: If the message is not a whole number of frames or a point is out of range.
+    """
+    if not data or len(data) % FRAME.size:
+        raise ValueError(f"Location message must be a multiple of {FRAME.size} bytes")
+
+    frames = [LocationFrame._make(values) for values in FRAME.iter_unpack(data)]
+    for frame in frames:
+        if not (-MAX_LATITUDE <= frame.latitude <= MAX_LATITUDE and -180 <= frame.longitude <= 180):
+            raise ValueError("Location out of range")
+    return frames
+
+
+def encode_message(user_id: UUID, frame: LocationFrame) -> bytes:
+    return MESSAGE.pack(user_id.bytes, *frame)
+
+
+def encode_stream_message(stream_id: str, message: bytes) -> bytes:
+    """
+    Prefix a message with the id it was given in the Redis stream, for publishing on pub/sub.
+    """
+    return stream_id.encode() + message
+
+
+def decode_stream_message(data: bytes) -> tuple[str, bytes]:
+    return data[:-MESSAGE.size].decode(), data[-MESSAGE.size:]
+
+
+def message_to_json(message: bytes) -> str:
+    """
+    Convert a message published to Redis into the JSON sent to SSE clients.
+    """
+    user_id, latitude, longitude, timestamp, accuracy = MESSAGE.unpack(message)
+    return json.dumps({
+        "user_id": str(UUID(bytes=user_id)),
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": timestamp,
+        "accuracy": None if math.isnan(accuracy) else accuracy,
+    })
@@ -14,3 +14,19 @@ class Location(Base):
 
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False, onupdate=func.now())
+
+
+class LocationHistory(Base):
+    """
+        Append-only log of the points sent by users.
+
+        The table is partitioned by day on recorded_at, so queries bounded in time only touch
+        the partitions they need and expired days are removed by dropping their partition.
+    """
+    __tablename__ = 'location_history'
+    __table_args__ = {"postgresql_partition_by": "RANGE (recorded_at)"}
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), primary_key=True, nullable=False)
+    recorded_at = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False)
+    latitude = Column(Double(), nullable=False)
+    longitude = Column(Double(), nullable=False)
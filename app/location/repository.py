@@ -1,11 +1,18 @@
+from datetime import date, datetime, timedelta
 from typing import Sequence
 
 import redis.client
 from redis.asyncio import Redis
-from sqlalchemy import select
+from sqlalchemy import select, values, column, text, Double
+from sqlalchemy.dialects.postgresql import insert, UUID, TIMESTAMP
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.location.models import Location
+from app.location.models import Location, LocationHistory
+from app.user.models import User
+from core.config import settings
+from core.utils.geo import haversine_distances
+
+from . import schemas
 
 
 class SqlAlchemyLocationRepository:
@@ -37,10 +44,290 @@ class SqlAlchemyLocationRepository:
         await session.flush()
         return location
 
+    @classmethod
+    async def upsert_bulk(cls, locations: list[schemas.LocationOut], session: AsyncSession) -> None:
+        """
+        Insert or update the locations of many users with a single statement.
+
+        Rows of users which do not exist anymore are skipped instead of failing the whole batch
+        on the foreign key.
+
+        Args:
+            locations (list[schemas.LocationOut]): Locations to persist, at most one per user.
+            session (AsyncSession): The database session.
+        """
+        incoming = values(
+            column("user_id", UUID(as_uuid=True)),
+            column("longitude", Double()),
+            column("latitude", Double()),
+            name="incoming",
+        ).data([(location.user_id, location.longitude, location.latitude) for location in locations])
+
+        query = insert(Location).from_select(
+            ["user_id", "longitude", "latitude"],
+            select(incoming.c.user_id, incoming.c.longitude, incoming.c.latitude)
+            .join(User, User.id == incoming.c.user_id)
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[Location.user_id],
+            set_={"longitude": query.excluded.longitude, "latitude": query.excluded.latitude}
+        )
+        await session.execute(query)
+        await session.commit()
+
+
+class SqlAlchemyLocationHistoryRepository:
+    partition_prefix = f"{LocationHistory.__tablename__}_"
+
+    @classmethod
+    async def add_bulk(cls, points: list[schemas.LocationHistoryIn], session: AsyncSession) -> None:
+        """
+        Append many points to the location history with a single statement.
+
+        Points of users which do not exist anymore are skipped.
+
+        Args:
+            points (list[schemas.LocationHistoryIn]): Points to append.
+            session (AsyncSession): The database session.
+        """
+        incoming = values(
+            column("user_id", UUID(as_uuid=True)),
+            column("recorded_at", TIMESTAMP(timezone=True)),
+            column("longitude", Double()),
+            column("latitude", Double()),
+            name="incoming",
+        ).data([(point.user_id, point.recorded_at, point.longitude, point.latitude) for point in points])
+
+        query = insert(LocationHistory).from_select(
+            ["user_id", "recorded_at", "longitude", "latitude"],
+            select(incoming.c.user_id, incoming.c.recorded_at, incoming.c.longitude, incoming.c.latitude)
+            .join(User, User.id == incoming.c.user_id)
+        ).on_conflict_do_nothing(index_elements=[LocationHistory.user_id, LocationHistory.recorded_at])
+        await session.execute(query)
+        await session.commit()
+
+    @classmethod
+    async def find_by_user_id(
+            cls,
+            user_id: str,
+            since: datetime,
+            cursor: datetime | None,
+            limit: int,
+            session: AsyncSession
+    ) -> Sequence[LocationHistory]:
+        """
+        Retrieve the points of a user in chronological order.
+
+        Args:
+            user_id (str): The unique identifier of the user.
+            since (datetime): Earliest point to return, also restricts the scanned partitions.
+            cursor (datetime | None): recorded_at of the last point of the previous page.
+            limit (int): The maximum number of points to retrieve.
+            session (AsyncSession): The database session.
+
+        Returns:
+            Sequence[LocationHistory]: The points, oldest first.
+        """
+        query = select(LocationHistory).filter(
+            LocationHistory.user_id == user_id,
+            LocationHistory.recorded_at >= since
+        )
+        if cursor is not None:
+            query = query.filter(LocationHistory.recorded_at > cursor)
+
+        query = query.order_by(LocationHistory.recorded_at).limit(limit)
+        return (await session.execute(query)).scalars().all()
+
+    @classmethod
+    def partition_name(cls, day: date) -> str:
+        return f"{cls.partition_prefix}{day:%Y%m%d}"
+
+    @classmethod
+    async def create_partition(cls, day: date, session: AsyncSession) -> None:
+        next_day = day + timedelta(days=1)
+        await session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {cls.partition_name(day)} "
+            f"PARTITION OF {LocationHistory.__tablename__} "
+            f"FOR VALUES FROM ('{day.isoformat()} 00:00+00') TO ('{next_day.isoformat()} 00:00+00')"
+        ))
+        await session.commit()
+
+    @classmethod
+    async def find_partitions(cls, session: AsyncSession) -> list[date]:
+        query = text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = :table_name"
+        )
+        names = (await session.execute(query, {"table_name": LocationHistory.__tablename__})).scalars().all()
+
+        days = []
+        for name in names:
+            try:
+                days.append(datetime.strptime(name.removeprefix(cls.partition_prefix), "%Y%m%d").date())
+            except ValueError:
+                # not a daily partition, e.g. a default partition attached by hand
+                continue
+        return days
+
+    @classmethod
+    async def drop_partition(cls, day: date, session: AsyncSession) -> None:
+        # removes the whole day at once, unlike a DELETE it leaves no dead rows to vacuum
+        await session.execute(text(f"DROP TABLE IF EXISTS {cls.partition_name(day)}"))
+        await session.commit()
+
+
+class RedisGeoLocationRepository:
+    """
+    Live locations kept in a Redis GEO set, mirroring the interface of SqlAlchemyLocationRepository.
+
+    Every member of the set is a user id and its score is the geohash of the last known position,
+    so writing a location is a single GEOADD regardless of whether the user had one before.
+    """
+    key = settings.redis_location_geo_key
+
+    @classmethod
+    async def find_by_user_id(cls, user_id: str, redis: Redis) -> schemas.LocationOut | None:
+        position, = await redis.geopos(cls.key, str(user_id))
+        if position is None:
+            return None
+        return schemas.LocationOut(user_id=user_id, longitude=position[0], latitude=position[1])
+
+    @classmethod
+    async def add(cls, user_id, longitude, latitude, redis: Redis) -> schemas.LocationOut:
+        await redis.geoadd(cls.key, [longitude, latitude, str(user_id)])
+        return schemas.LocationOut(user_id=user_id, longitude=longitude, latitude=latitude)
+
+    @classmethod
+    async def find_bulk_by_user_ids(cls, user_ids: list[str], redis: Redis) -> list[schemas.LocationOut]:
+        if not user_ids:
+            return []
+        positions = await redis.geopos(cls.key, *[str(user_id) for user_id in user_ids])
+        return [
+            schemas.LocationOut(user_id=user_id, longitude=position[0], latitude=position[1])
+            for user_id, position in zip(user_ids, positions)
+            if position is not None
+        ]
+
+    @classmethod
+    async def update(cls, user_id: str, longitude: float, latitude: float, redis: Redis) -> schemas.LocationOut:
+        return await cls.add(user_id=user_id, longitude=longitude, latitude=latitude, redis=redis)
+
+    @classmethod
+    async def find_bulk_in_radius(
+            cls,
+            user_ids: list[str],
+            longitude: float,
+            latitude: float,
+            radius: float,
+            redis: Redis
+    ) -> list[schemas.LocationNearbyOut]:
+        """
+        Retrieve the locations of some users within the radius of a point, nearest first.
+
+        The positions of the users are read with a single GEOPOS and their distances computed
+        locally, so the cost follows the number of users asked for, not the number of users who
+        happen to be near the point, as with a GEOSEARCH over the whole set.
+
+        Args:
+            user_ids (list[str]): IDs of the users.
+            longitude (float): Longitude of the centre.
+            latitude (float): Latitude of the centre.
+            radius (float): Radius in meters.
+            redis (Redis): The Redis connection.
+
+        Returns:
+            list[schemas.LocationNearbyOut]: Locations with their distance to the centre in meters.
+        """
+        locations = await cls.find_bulk_by_user_ids(user_ids=user_ids, redis=redis)
+        distances = haversine_distances(
+            longitude,
+            latitude,
+            [location.longitude for location in locations],
+            [location.latitude for location in locations]
+        )
+        nearby = [
+            schemas.LocationNearbyOut(
+                user_id=location.user_id, distance=distance, longitude=location.longitude, latitude=location.latitude
+            )
+            for location, distance in zip(locations, distances)
+            if distance <= radius
+        ]
+        nearby.sort(key=lambda location: location.distance)
+        return nearby
+
+
+    @classmethod
+    async def find_bulk_in_box(
+            cls,
+            user_ids: list[str],
+            bbox: schemas.BoundingBox,
+            redis: Redis
+    ) -> list[schemas.LocationOut]:
+        """
+        Retrieve the locations of some users inside a bounding box.
+
+        The positions of the users are read with a single GEOPOS, users without a live location are
+        left out instead of being looked up in the database.
+
+        Args:
+            user_ids (list[str]): IDs of the users.
+            bbox (schemas.BoundingBox): The box, it may cross the antimeridian.
+            redis (Redis): The Redis connection.
+
+        Returns:
+            list[schemas.LocationOut]: The locations inside the box.
+        """
+        return [
+            location for location in await cls.find_bulk_by_user_ids(user_ids=user_ids, redis=redis)
+            if bbox.contains(longitude=location.longitude, latitude=location.latitude)
+        ]
+
+
+class RedisStreamRepository:
+    """
+    Recent location updates of a user kept in a Redis stream, so subscribers can catch up after a reconnect.
+    """
+    field = "data"
+
+    @classmethod
+    async def add(cls, key: str, message: bytes, max_len: int, ttl: int, redis: Redis) -> str:
+        """
+        Append a message, trimming the stream to about max_len entries.
+
+        Returns:
+            str: The id of the new entry.
+        """
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {cls.field: message}, maxlen=max_len, approximate=True)
+            pipe.expire(key, ttl)
+            stream_id, _ = await pipe.execute()
+        return stream_id.decode()
+
+    @classmethod
+    async def find_after(cls, key: str, stream_id: str, count: int, redis: Redis) -> list[tuple[str, bytes]]:
+        """
+        Retrieve the entries following stream_id, oldest first.
+        """
+        entries = await redis.xrange(key, min=f"({stream_id}", max="+", count=count)
+        return [(entry_id.decode(), fields[cls.field.encode()]) for entry_id, fields in entries]
+
+    @staticmethod
+    def parse_id(stream_id: str) -> tuple[int, int]:
+        """
+        Split a stream id into its comparable parts.
+
+        Raises:
+            ValueError: If the value is not a stream id.
+        """
+        milliseconds, sequence = stream_id.split("-")
+        return int(milliseconds), int(sequence)
+
 
 class RedisPubSubRepository:
     @classmethod
-    async def publish(cls, channel: str, message: str, redis: Redis):
+    async def publish(cls, channel: str, message: str | bytes, redis: Redis):
         await redis.publish(channel, message)
 
     @classmethod
@@ -1,4 +1,6 @@
-from pydantic import BaseModel, UUID4
+from datetime import datetime
+
+from pydantic import BaseModel, Field, UUID4, model_validator
 
 
 class LocationBase(BaseModel):
@@ -15,3 +17,69 @@ class LocationOut(LocationBase):
 
 class LocationInRedis(LocationOut):
     pass
+
+
+class LocationNearbyOut(LocationOut):
+    # distance from the requesting user in meters
+    distance: float
+
+
+class LocationHistoryIn(LocationOut):
+    recorded_at: datetime
+
+
+class LocationHistoryOut(LocationBase):
+    recorded_at: datetime
+
+
+class LocationHistoryPage(BaseModel):
+    items: list[LocationHistoryOut]
+    # pass as cursor to continue after the last returned point, also when polling for new ones
+    next_cursor: datetime | None
+    has_more: bool
+
+
+class BoundingBox(BaseModel):
+    # min_longitude greater than max_longitude means the box crosses the antimeridian
+    min_longitude: float = Field(ge=-180, le=180)
+    min_latitude: float = Field(ge=-90, le=90)
+    max_longitude: float = Field(ge=-180, le=180)
+    max_latitude: float = Field(ge=-90, le=90)
+
+    @model_validator(mode="after")
+    def check_latitudes(self) -> "BoundingBox":
+        if self.min_latitude > self.max_latitude:
+            raise ValueError("min_latitude is greater than max_latitude")
+        return self
+
+    @classmethod
+    def from_query(cls, bbox: str) -> "BoundingBox":
+        """
+        Parse a "min_longitude,min_latitude,max_longitude,max_latitude" query parameter.
+
+        Raises:
+            ValueError: If the value is not four coordinates forming a valid box.
+        """
+        values = bbox.split(",")
+        if len(values) != 4:
+            raise ValueError("bbox must have four coordinates")
+        return cls(**dict(zip(cls.model_fields, map(float, values))))
+
+    def contains(self, longitude: float, latitude: float) -> bool:
+        if not self.min_latitude <= latitude <= self.max_latitude:
+            return False
+        if self.min_longitude <= self.max_longitude:
+            return self.min_longitude <= longitude <= self.max_longitude
+        return longitude >= self.min_longitude or longitude <= self.max_longitude
+
+
+class LocationClusterOut(LocationBase):
+    # longitude and latitude are the centroid of the friends in the cell
+    geohash: str
+    count: int
+
+
+class LocationViewportOut(BaseModel):
+    # at low zoom the friends are grouped in clusters, otherwise returned as locations
+    clusters: list[LocationClusterOut]
+    locations: list[LocationOut]
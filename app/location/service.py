@@ -1,71 +1,257 @@
-from asyncpg import UniqueViolationError
+from collections import defaultdict
+from datetime import datetime
+from typing import Sequence
+
 from pydantic import UUID4
-from redis.asyncio import Redis
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.friends.service import FriendshipService, get_friendships_channel
 from core.db.session import async_session_factory
+from core.exceptions import LocationNotFound
+from core.redis.pubsub import pubsub_multiplexer
 from core.redis.session import get_redis_connection
+from core.utils.geo import geohash_encode, geohash_precision_for_zoom
 
 from core.config import settings
 
 
 from . import schemas
-from .repository import SqlAlchemyLocationRepository, RedisPubSubRepository
+from .codec import LocationFrame, decode_stream_message, encode_message, encode_stream_message, message_to_json
+from .repository import (
+    SqlAlchemyLocationRepository,
+    SqlAlchemyLocationHistoryRepository,
+    RedisGeoLocationRepository,
+    RedisStreamRepository,
+    RedisPubSubRepository
+)
+from .throttle import location_publish_throttle
+from .write_behind import location_write_behind_buffer
+
+
+def get_location_channel(user_id: UUID4 | str) -> str:
+    """
+    Name of the Redis channel carrying the location updates of a single user.
+    """
+    return f"channel:{settings.redis_location_channel}:{user_id}"
+
+
+def get_location_stream_key(user_id: UUID4 | str) -> str:
+    """
+    Name of the Redis stream keeping the recent location updates of a single user for replay.
+    """
+    return f"stream:{settings.redis_location_channel}:{user_id}"
 
 
 class LocationService:
     def __init__(self):
         self.sql_alchemy_location_repository = SqlAlchemyLocationRepository()
+        self.sql_alchemy_location_history_repository = SqlAlchemyLocationHistoryRepository()
+        self.redis_geo_location_repository = RedisGeoLocationRepository()
+        self.redis_stream_repository = RedisStreamRepository()
         self.redis_pub_sub_repository = RedisPubSubRepository()
         self.redis_connection = get_redis_connection()
 
     async def get_location_by_user_id(self, user_id: str) -> schemas.LocationOut:
+        location = await self.redis_geo_location_repository.find_by_user_id(
+            user_id=str(user_id), redis=self.redis_connection
+        )
+        if location:
+            return location
+
+        # live store may have been flushed, fall back to the last snapshot
         async with async_session_factory() as session:
             location_in_db = await self.sql_alchemy_location_repository.find_by_user_id(user_id=user_id, session=session)
-            return schemas.LocationOut.model_validate(location_in_db)
+        if not location_in_db:
+            raise LocationNotFound()
+        return schemas.LocationOut.model_validate(location_in_db)
 
     async def set_or_update_location_by_user_id(self, location: schemas.LocationBase, user_id: UUID4) -> schemas.LocationOut:
-        try:
-            return await self.set_location_by_user_id(location=location, user_id=user_id)
-        except IntegrityError:
-            return await self.update_location_by_user_id(location=location, user_id=user_id)
+        location_in_redis = await self.redis_geo_location_repository.add(
+            user_id=str(user_id), longitude=location.longitude, latitude=location.latitude, redis=self.redis_connection
+        )
+        location_write_behind_buffer.add(location_in_redis)
+        return location_in_redis
 
-    async def set_location_by_user_id(self, location: schemas.LocationBase, user_id: UUID4) -> schemas.LocationOut:
-        async with async_session_factory() as session:
-            location_in_db = await self.sql_alchemy_location_repository.add(
-                user_id=str(user_id), longitude=location.longitude, latitude=location.latitude, session=session
+    async def get_all_friends_locations(self, friends_ids: list[str]) -> list[schemas.LocationOut]:
+        locations = await self.redis_geo_location_repository.find_bulk_by_user_ids(
+            user_ids=friends_ids, redis=self.redis_connection
+        )
+
+        found_ids = {str(location.user_id) for location in locations}
+        missing_ids = [friend_id for friend_id in friends_ids if str(friend_id) not in found_ids]
+        if missing_ids:
+            async with async_session_factory() as session:
+                locations_in_db = await self.sql_alchemy_location_repository.find_bulk_by_user_ids(
+                    user_ids=missing_ids, session=session
+                )
+            locations.extend(schemas.LocationOut.model_validate(location) for location in locations_in_db)
+
+        return locations
+
+    async def get_nearby_friends_locations(
+            self,
+            user_id: UUID4,
+            friends_ids: list[str],
+            radius: float,
+            longitude: float | None = None,
+            latitude: float | None = None
+    ) -> list[schemas.LocationNearbyOut]:
+        if longitude is None or latitude is None:
+            centre = await self.get_location_by_user_id(user_id=str(user_id))
+            longitude, latitude = centre.longitude, centre.latitude
+
+        return await self.redis_geo_location_repository.find_bulk_in_radius(
+            user_ids=friends_ids, longitude=longitude, latitude=latitude, radius=radius, redis=self.redis_connection
+        )
+
+    async def get_friends_locations_in_viewport(
+            self,
+            friends_ids: list[str],
+            bbox: schemas.BoundingBox,
+            zoom: int
+    ) -> schemas.LocationViewportOut:
+        """
+        Get the friends inside a map viewport.
+
+        Only the live positions of the friends are read, from Redis in one round trip, the database
+        is not queried for friends without one. Up to location_viewport_cluster_max_zoom the friends
+        are grouped by geohash cell, the cell size follows the zoom so the number of clusters depends
+        on the viewport, not on the number of friends.
+        """
+        locations = await self.redis_geo_location_repository.find_bulk_in_box(
+            user_ids=friends_ids, bbox=bbox, redis=self.redis_connection
+        )
+        if zoom > settings.location_viewport_cluster_max_zoom:
+            return schemas.LocationViewportOut(clusters=[], locations=locations)
+
+        precision = geohash_precision_for_zoom(zoom)
+        cells = defaultdict(list)
+        for location in locations:
+            cells[geohash_encode(longitude=location.longitude, latitude=location.latitude, precision=precision)].append(location)
+
+        clusters = [
+            schemas.LocationClusterOut(
+                geohash=geohash,
+                count=len(members),
+                longitude=sum(member.longitude for member in members) / len(members),
+                latitude=sum(member.latitude for member in members) / len(members)
             )
-            return schemas.LocationOut.model_validate(location_in_db)
-    
-    async def update_location_by_user_id(self, location: schemas.LocationBase, user_id: UUID4) -> schemas.LocationOut:
+            for geohash, members in cells.items()
+        ]
+        return schemas.LocationViewportOut(clusters=clusters, locations=[])
+
+    async def get_location_history(
+            self,
+            user_id: UUID4,
+            since: datetime,
+            cursor: datetime | None,
+            limit: int
+    ) -> schemas.LocationHistoryPage:
         async with async_session_factory() as session:
-            location_in_db = await self.sql_alchemy_location_repository.update(
-                user_id=str(user_id), longitude=location.longitude, latitude=location.latitude, session=session
+            points = await self.sql_alchemy_location_history_repository.find_by_user_id(
+                user_id=str(user_id), since=since, cursor=cursor, limit=limit, session=session
             )
-            return schemas.LocationOut.model_validate(location_in_db)
 
-    async def get_all_friends_locations(self, friends_ids: list[str]) -> list[schemas.LocationOut]:
-        async with async_session_factory() as session:
-            locations = await self.sql_alchemy_location_repository.find_bulk_by_user_ids(user_ids=friends_ids, session=session)
-            return [schemas.LocationOut.model_validate(location) for location in locations]
+        items = [schemas.LocationHistoryOut.model_validate(point) for point in points]
+        return schemas.LocationHistoryPage(
+            items=items,
+            next_cursor=items[-1].recorded_at if items else cursor,
+            has_more=len(items) == limit
+        )
 
     async def publish_location(self, location: schemas.LocationBase, user_id: UUID4):
-        modified_location = schemas.LocationInRedis(user_id=user_id, longitude=location.longitude, latitude=location.latitude)
+        await self.publish_locations(locations=[LocationFrame.from_location(location)], user_id=user_id)
 
-        await self.redis_pub_sub_repository.publish(
-            channel=f"channel:{settings.redis_location_channel}",
-            message=modified_location.model_dump_json(),
-            redis=self.redis_connection
+    async def publish_locations(self, locations: Sequence[LocationFrame], user_id: UUID4) -> bool:
+        """
+        Store and publish the newest of a batch of points, unless the user has not moved enough.
+
+        The point is appended to the stream of the user, then published with its stream id in the compact
+        binary form of the codec. Subscribers convert it to JSON.
+
+        Returns:
+            bool: True if the location was published, False if it was suppressed.
+        """
+        location = location_publish_throttle.select(user_id=str(user_id), locations=locations)
+        if location is None:
+            return False
+
+        location_in_redis = await self.redis_geo_location_repository.add(
+            user_id=str(user_id), longitude=location.longitude, latitude=location.latitude, redis=self.redis_connection
         )
+        location_write_behind_buffer.add(location_in_redis)
 
-    async def subscribe_location_with_user_id(self, user_id: str):
-        pubsub = await self.redis_pub_sub_repository.subscribe(
-            channel=f"channel:{settings.redis_location_channel}",
+        message = encode_message(user_id=user_id, frame=location)
+        stream_id = await self.redis_stream_repository.add(
+            key=get_location_stream_key(user_id),
+            message=message,
+            max_len=settings.redis_location_stream_max_len,
+            ttl=settings.redis_location_stream_ttl,
+            redis=self.redis_connection
+        )
+        await self.redis_pub_sub_repository.publish(
+            channel=get_location_channel(user_id),
+            message=encode_stream_message(stream_id=stream_id, message=message),
             redis=self.redis_connection
         )
-        while True:
-            location = await pubsub.get_message(ignore_subscribe_messages=True)
-            if location is not None and user_id in location["data"].decode():
-                yield location["data"].decode()
+        return True
+
+    def stop_publishing(self, user_id: UUID4) -> None:
+        location_publish_throttle.forget(user_id=str(user_id))
+
+    async def subscribe_friends_locations(self, user_id: UUID4, friendship_service: FriendshipService):
+        """
+        Stream the locations of all the friends of a user over a single subscription.
+
+        The current locations are sent first, in the same JSON as the live updates, through the codec.
+        The friend set is resolved once and refreshed whenever a friendship of the user changes.
+        """
+        friendships_channel = get_friendships_channel(user_id)
+        friends_ids = set(await friendship_service.get_friend_ids(user_id=str(user_id)))
+
+        channels = [get_location_channel(friend_id) for friend_id in friends_ids]
+        async with pubsub_multiplexer.subscription(friendships_channel, *channels) as subscription:
+            for location in await self.get_all_friends_locations(friends_ids=list(friends_ids)):
+                yield message_to_json(
+                    encode_message(user_id=location.user_id, frame=LocationFrame.from_location(location))
+                )
+
+            async for channel, location in subscription:
+                if channel != friendships_channel:
+                    _, message = decode_stream_message(location)
+                    yield message_to_json(message)
+                    continue
+
+                current_friends_ids = set(await friendship_service.get_friend_ids(user_id=str(user_id)))
+                await pubsub_multiplexer.add_channels(
+                    subscription, *[get_location_channel(friend_id) for friend_id in current_friends_ids - friends_ids]
+                )
+                await pubsub_multiplexer.remove_channels(
+                    subscription, *[get_location_channel(friend_id) for friend_id in friends_ids - current_friends_ids]
+                )
+                friends_ids = current_friends_ids
+
+    async def subscribe_location_with_user_id(self, user_id: str, last_event_id: str | None = None):
+        """
+        Stream the location updates of a user as (stream id, JSON) pairs.
+
+        When last_event_id is given, the updates published after it that are still in the stream of the
+        user are replayed before the live ones. The subscription is opened first so nothing published
+        during the replay is missed, live updates already replayed are skipped.
+        """
+        async with pubsub_multiplexer.subscription(get_location_channel(user_id)) as subscription:
+            last_sent = None
+            if last_event_id is not None:
+                for stream_id, message in await self.redis_stream_repository.find_after(
+                        key=get_location_stream_key(user_id),
+                        stream_id=last_event_id,
+                        count=settings.redis_location_stream_max_len,
+                        redis=self.redis_connection
+                ):
+                    yield stream_id, message_to_json(message)
+                    last_sent = self.redis_stream_repository.parse_id(stream_id)
 
+            async for _, location in subscription:
+                stream_id, message = decode_stream_message(location)
+                if last_sent is not None and self.redis_stream_repository.parse_id(stream_id) <= last_sent:
+                    continue
+                yield stream_id, message_to_json(message)
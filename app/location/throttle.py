@@ -0,0 +1,74 @@
+import time
+from typing import Sequence
+
+from prometheus_client import Counter
+
+from core.config import settings
+from core.utils.geo import haversine_distances
+
+from .codec import LocationFrame
+
+forwarded_updates = Counter("location_updates_forwarded_total", "Location updates published to subscribers")
+suppressed_updates = Counter("location_updates_suppressed_total", "Location updates dropped as not moved enough")
+
+
+class LocationPublishThrottle:
+    """
+    Decides whether a location update is worth publishing.
+
+    An update is forwarded when the user moved at least min_distance meters since the last published
+    point, or when max_interval seconds passed since then, so stationary users still send a heartbeat.
+    The state is kept per worker, which is enough as a user's websocket lives on a single worker.
+    """
+
+    def __init__(self, min_distance: float, max_interval: float):
+        self.min_distance = min_distance
+        self.max_interval = max_interval
+        self._last_published: dict[str, tuple[float, float, float]] = {}
+
+    def select(self, user_id: str, locations: Sequence[LocationFrame]) -> LocationFrame | None:
+        """
+        Pick the point of a batch to publish.
+
+        Distances from the last published point are computed for the whole batch at once. Only the newest
+        point is ever published, as subscribers only care about the current position.
+
+        Args:
+            user_id (str): The ID of the user sending the batch.
+            locations (Sequence[LocationFrame]): Points of the user, oldest first.
+
+        Returns:
+            LocationFrame | None: The point to publish, None when the whole batch is suppressed.
+        """
+        if not locations:
+            return None
+
+        now = time.monotonic()
+        latest = locations[-1]
+        last_published = self._last_published.get(user_id)
+
+        if last_published is not None and now - last_published[2] < self.max_interval:
+            last_longitude, last_latitude, _ = last_published
+            distances = haversine_distances(
+                last_longitude,
+                last_latitude,
+                [location.longitude for location in locations],
+                [location.latitude for location in locations]
+            )
+            if max(distances) < self.min_distance:
+                suppressed_updates.inc(len(locations))
+                return None
+
+        self._last_published[user_id] = (latest.longitude, latest.latitude, now)
+        forwarded_updates.inc()
+        suppressed_updates.inc(len(locations) - 1)
+        return latest
+
+    def forget(self, user_id: str) -> None:
+        self._last_published.pop(user_id, None)
+
+
+location_publish_throttle = LocationPublishThrottle(
+    min_distance=settings.location_publish_min_distance,
+    max_interval=settings.location_publish_max_interval
+)
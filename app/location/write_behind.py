@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+from prometheus_client import Counter
+
+from core.config import settings
+from core.db.session import async_session_factory
+
+from . import schemas
+from .repository import SqlAlchemyLocationRepository, SqlAlchemyLocationHistoryRepository
+
+PARTITION_MAINTENANCE_INTERVAL = 3600  # seconds
+
+buffered_updates = Counter("location_buffered_updates_total", "Location updates handed to the write-behind buffer")
+flushed_rows = Counter("location_flushed_rows_total", "Location rows written to Postgres by the write-behind buffer")
+flushed_batches = Counter("location_flushed_batches_total", "INSERT statements issued by the write-behind buffer")
+flushed_history_rows = Counter("location_flushed_history_rows_total", "Points appended to the location history")
+
+
+class LocationWriteBehindBuffer:
+    """
+    Collects location updates in memory and persists them to Postgres in batches.
+
+    Only the latest point of every user is kept for the location table, so a user sending an update
+    every second costs one row per flush interval instead of one transaction per update. Every point is
+    also appended to the location history. The buffer is flushed every flush_interval seconds, as soon
+    as it holds max_batch_size rows, and once more on shutdown.
+
+    The buffer also owns the daily partitions of the history: it creates the upcoming ones and drops
+    the ones older than the retention period.
+    """
+
+    def __init__(self, flush_interval: float, max_batch_size: int, history_retention_days: int,
+                 history_partitions_ahead: int):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.history_retention_days = history_retention_days
+        self.history_partitions_ahead = history_partitions_ahead
+        self.sql_alchemy_location_repository = SqlAlchemyLocationRepository()
+        self.sql_alchemy_location_history_repository = SqlAlchemyLocationHistoryRepository()
+        self._pending: dict[str, schemas.LocationOut] = {}
+        self._history: list[schemas.LocationHistoryIn] = []
+        self._wakeup = asyncio.Event()
+        self._stopped = False
+        self._task: asyncio.Task | None = None
+
+    def add(self, location: schemas.LocationOut) -> None:
+        self._pending[str(location.user_id)] = location
+        self._history.append(
+            schemas.LocationHistoryIn(**location.model_dump(), recorded_at=datetime.now(timezone.utc))
+        )
+        buffered_updates.inc()
+        if len(self._history) >= self.max_batch_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        self._stopped = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        # updates received while the last flush was running
+        await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Write every pending location with one INSERT ... ON CONFLICT per max_batch_size users,
+        and append the buffered points to the history.
+
+        Locations of a failed batch are put back unless a newer update arrived in the meantime.
+        History points of a failed batch are dropped, the latest location is what must not be lost.
+
+        Returns:
+            int: The number of locations written.
+        """
+        pending, self._pending = list(self._pending.values()), {}
+        history, self._history = self._history, []
+
+        written = 0
+        for batch in self._batches(pending):
+            try:
+                async with async_session_factory() as session:
+                    await self.sql_alchemy_location_repository.upsert_bulk(locations=batch, session=session)
+            except Exception as e:
+                logger.error(f"Location flush of {len(batch)} users failed: {e}")
+                for location in batch:
+                    self._pending.setdefault(str(location.user_id), location)
+                continue
+
+            written += len(batch)
+            flushed_batches.inc()
+
+        for batch in self._batches(history):
+            try:
+                async with async_session_factory() as session:
+                    await self.sql_alchemy_location_history_repository.add_bulk(points=batch, session=session)
+            except Exception as e:
+                logger.error(f"Location history flush of {len(batch)} points failed: {e}")
+                continue
+
+            flushed_batches.inc()
+            flushed_history_rows.inc(len(batch))
+
+        flushed_rows.inc(written)
+        return written
+
+    async def maintain_history_partitions(self) -> None:
+        """
+        Create the partitions of today and the upcoming days, drop the ones past the retention period.
+        """
+        today = datetime.now(timezone.utc).date()
+        expired_before = today - timedelta(days=self.history_retention_days)
+
+        async with async_session_factory() as session:
+            for offset in range(self.history_partitions_ahead + 1):
+                await self.sql_alchemy_location_history_repository.create_partition(
+                    day=today + timedelta(days=offset), session=session
+                )
+
+            for day in await self.sql_alchemy_location_history_repository.find_partitions(session=session):
+                if day < expired_before:
+                    await self.sql_alchemy_location_history_repository.drop_partition(day=day, session=session)
+
+    def _batches(self, rows: list) -> list[list]:
+        return [rows[i:i + self.max_batch_size] for i in range(0, len(rows), self.max_batch_size)]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        maintained_at = None
+
+        while not self._stopped:
+            if maintained_at is None or loop.time() - maintained_at > PARTITION_MAINTENANCE_INTERVAL:
+                try:
+                    await self.maintain_history_partitions()
+                    maintained_at = loop.time()
+                except Exception as e:
+                    logger.error(f"Location history partition maintenance failed: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+location_write_behind_buffer = LocationWriteBehindBuffer(
+    flush_interval=settings.location_flush_interval,
+    max_batch_size=settings.location_flush_max_batch_size,
+    history_retention_days=settings.location_history_retention_days,
+    history_partitions_ahead=settings.location_history_partitions_ahead
+)
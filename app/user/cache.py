@@ -0,0 +1,244 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Literal
+
+from loguru import logger
+from prometheus_client import Counter
+from pydantic import UUID4
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.redis.pubsub import pubsub_multiplexer
+from core.redis.session import get_redis_connection
+
+from .schemas import UserRecord
+
+USER_CACHE_CHANNEL = "channel:users:invalidate"
+LISTEN_RETRY_DELAY = 1  # second, doubled after every failed attempt
+LISTEN_MAX_RETRY_DELAY = 30  # seconds
+
+cache_hits = Counter("user_cache_hits_total", "User lookups served from a cache", ["tier"])
+cache_misses = Counter("user_cache_misses_total", "User lookups that had to query the database")
+cache_invalidations = Counter("user_cache_invalidations_total", "Users invalidated in the memory of the worker")
+
+LookupField = Literal["id", "username", "email"]
+
+
+class UserCache:
+    """
+    Read-through cache of user records, an in-process TTL/LRU in front of Redis.
+
+    Records are stored by ID. Usernames and emails only point to an ID and are checked against the
+    record they lead to, so invalidating a user only has to drop the entry of its ID, whatever it was
+    renamed from. Missing users are not cached.
+
+    Invalidating a user replaces its entry with a short-lived tombstone in Redis and, through pub/sub,
+    in the memory of every worker. A lookup that read the database before the change can't store the
+    old record during that time. Concurrent lookups missing the same user share one database query.
+
+    Attributes:
+        redis_connection (Redis | None): Redis client, None to only cache in memory.
+        ttl (int): Seconds a record is kept in Redis.
+        local_ttl (float): Seconds a record is kept in memory.
+        local_size (int): Entries kept in memory.
+        tombstone_ttl (int): Seconds an invalidated user is not cached again.
+    """
+
+    key_prefix = "user"
+
+    def __init__(self, redis_connection: Redis | None, ttl: int, local_ttl: float, local_size: int,
+                 tombstone_ttl: int):
+        self.redis_connection = redis_connection
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.tombstone_ttl = tombstone_ttl
+        # key -> (record by ID, user ID by username or email, None for a tombstone; monotonic expiry)
+        self._entries: OrderedDict[str, tuple[UserRecord | str | None, float]] = OrderedDict()
+        self._loads: dict[str, asyncio.Future] = {}
+        self._listener: asyncio.Task | None = None
+
+    def get_key(self, field: LookupField, value: str) -> str:
+        if field == "id":
+            return f"{self.key_prefix}:{value}"
+        return f"{self.key_prefix}:{field}:{value}"
+
+    async def get_by_id(self, user_id: UUID4 | str,
+                        load: Callable[[], Awaitable[UserRecord | None]]) -> UserRecord | None:
+        return await self._get("id", str(user_id), load)
+
+    async def get_by_username(self, username: str,
+                              load: Callable[[], Awaitable[UserRecord | None]]) -> UserRecord | None:
+        return await self._get("username", username, load)
+
+    async def get_by_email(self, email: str,
+                           load: Callable[[], Awaitable[UserRecord | None]]) -> UserRecord | None:
+        return await self._get("email", email, load)
+
+    async def invalidate(self, user_id: UUID4 | str) -> None:
+        """
+        Drop a user from the cache of every worker, after it was updated or deleted.
+        """
+        user_id = str(user_id)
+        self._invalidate_local(user_id)
+        if self.redis_connection is None:
+            return
+
+        try:
+            async with self.redis_connection.pipeline(transaction=False) as pipe:
+                pipe.set(self.get_key("id", user_id), b"", ex=self.tombstone_ttl)
+                pipe.publish(USER_CACHE_CHANNEL, user_id)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f"User {user_id} could not be invalidated in Redis: {e}")
+
+    def start(self) -> None:
+        if self.redis_connection is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self) -> None:
+        delay = LISTEN_RETRY_DELAY
+        while True:
+            try:
+                async with pubsub_multiplexer.subscription(USER_CACHE_CHANNEL) as subscription:
+                    delay = LISTEN_RETRY_DELAY
+                    async for _, user_id in subscription:
+                        self._invalidate_local(user_id.decode())
+            except Exception as e:
+                # without the listener, other workers' invalidations are missed until the local TTL expires
+                logger.error(f"User cache invalidation listener failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTEN_MAX_RETRY_DELAY)
+
+    async def _get(self, field: LookupField, value: str,
+                   load: Callable[[], Awaitable[UserRecord | None]]) -> UserRecord | None:
+        record = self._get_local(field, value)
+        if record is not None:
+            cache_hits.labels(tier="memory").inc()
+            return record
+
+        key = self.get_key(field, value)
+        loading = self._loads.get(key)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(field, value, load))
+            self._loads[key] = loading
+            loading.add_done_callback(lambda _: self._loads.pop(key, None))
+        # a caller going away must not cancel the query the others are waiting for
+        return await asyncio.shield(loading)
+
+    async def _load(self, field: LookupField, value: str,
+                    load: Callable[[], Awaitable[UserRecord | None]]) -> UserRecord | None:
+        record = await self._get_redis(field, value)
+        if record is not None:
+            cache_hits.labels(tier="redis").inc()
+            self._put_local(record)
+            return record
+
+        cache_misses.inc()
+        record = await load()
+        if record is not None:
+            await self._put(record)
+        return record
+
+    def _get_local(self, field: LookupField, value: str) -> UserRecord | None:
+        user_id = value if field == "id" else self._get_entry(self.get_key(field, value))
+        if not isinstance(user_id, str):
+            return None
+        record = self._get_entry(self.get_key("id", user_id))
+        if not isinstance(record, UserRecord):
+            return None
+        if field != "id" and getattr(record, field) != value:
+            return None
+        return record
+
+    async def _get_redis(self, field: LookupField, value: str) -> UserRecord | None:
+        if self.redis_connection is None:
+            return None
+
+        try:
+            user_id = value
+            if field != "id":
+                user_id = await self.redis_connection.get(self.get_key(field, value))
+                if user_id is None:
+                    return None
+                user_id = user_id.decode()
+            data = await self.redis_connection.get(self.get_key("id", user_id))
+        except RedisError as e:
+            logger.warning(f"User cache could not be read from Redis: {e}")
+            return None
+
+        # missing or tombstone
+        if not data:
+            return None
+        record = UserRecord.model_validate_json(data)
+        if field != "id" and getattr(record, field) != value:
+            return None
+        return record
+
+    async def _put(self, record: UserRecord) -> None:
+        user_id = str(record.id)
+        if self.redis_connection is not None:
+            try:
+                async with self.redis_connection.pipeline(transaction=False) as pipe:
+                    # not over a tombstone
+                    pipe.set(self.get_key("id", user_id), record.model_dump_json(), ex=self.ttl, nx=True)
+                    pipe.set(self.get_key("username", record.username), user_id, ex=self.ttl)
+                    pipe.set(self.get_key("email", record.email), user_id, ex=self.ttl)
+                    stored, _, _ = await pipe.execute()
+            except RedisError as e:
+                logger.warning(f"User cache could not be written to Redis: {e}")
+            else:
+                if not stored:
+                    return
+        self._put_local(record)
+
+    def _put_local(self, record: UserRecord) -> None:
+        user_id = str(record.id)
+        key = self.get_key("id", user_id)
+        if key in self._entries and self._entries[key][0] is None and self._entries[key][1] > time.monotonic():
+            return
+
+        expires_at = time.monotonic() + self.local_ttl
+        self._set_entry(key, record, expires_at)
+        self._set_entry(self.get_key("username", record.username), user_id, expires_at)
+        self._set_entry(self.get_key("email", record.email), user_id, expires_at)
+
+    def _invalidate_local(self, user_id: str) -> None:
+        self._set_entry(self.get_key("id", user_id), None, time.monotonic() + self.tombstone_ttl)
+        cache_invalidations.inc()
+
+    def _get_entry(self, key: str) -> UserRecord | str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _set_entry(self, key: str, value: UserRecord | str | None, expires_at: float) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.local_size:
+            self._entries.popitem(last=False)
+
+
+user_cache = UserCache(
+    redis_connection=get_redis_connection(),
+    ttl=settings.user_cache_ttl,
+    local_ttl=settings.user_cache_local_ttl,
+    local_size=settings.user_cache_local_size,
+    tombstone_ttl=settings.user_cache_tombstone_ttl
+)
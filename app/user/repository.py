@@ -6,23 +6,50 @@ from pydantic import UUID4
 from sqlalchemy import select, delete, update
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 
 from . import models, schemas
+from .cache import user_cache
 from core import exceptions
 from core.utils import password_helper
 
 
 class UserRepository:
+    # columns returned to clients, password and admin flag are never loaded for listings
+    public_columns = (
+        models.User.id,
+        models.User.username,
+        models.User.email,
+        models.User.fullname,
+        models.User.birthdate,
+        models.User.profile_image,
+        models.User.registration_date,
+        models.User.is_active,
+        models.User.last_login,
+        models.User.verified,
+    )
+
     @classmethod
-    async def find_all(cls, session: AsyncSession) -> list[models.User]:
+    async def find_page(cls, session: AsyncSession, after_id: Optional[UUID4], limit: int) -> list[models.User]:
         """
-        Retrieve all users from the database.
+        Retrieve a page of users ordered by ID, with only their public columns loaded.
+
+        The page is read from the primary key index starting after after_id, so its cost does not
+        depend on the number of users before it.
+
+        Args:
+            session (AsyncSession): The database session.
+            after_id (Optional[UUID4]): The ID of the last user of the previous page.
+            limit (int): The maximum number of users.
 
         Returns:
-            list[models.User]: A list of all users in the database.
+            list[models.User]: The users.
         """
-        users = (await session.execute(select(models.User))).scalars().all()
-        return users
+        query = select(models.User).options(load_only(*cls.public_columns)).order_by(models.User.id).limit(limit)
+        if after_id is not None:
+            query = query.where(models.User.id > after_id)
+
+        return list((await session.execute(query)).scalars().all())
 
     @classmethod
     async def find_by_id(cls, session: AsyncSession, user_id: str) -> Optional[models.User]:
@@ -114,7 +141,7 @@ class UserRepository:
     @classmethod
     async def update(cls, session: AsyncSession, new_values: dict, user_id: str) -> models.User:
         """
-        Update the verification status of a user to True.
+        Update the verification status of a user to True, and drop it from the user cache.
 
         Args:
             session (AsyncSession): The database session.
@@ -136,6 +163,7 @@ class UserRepository:
             )
             result = await session.execute(query)
             await session.commit()
+            await user_cache.invalidate(user_id)
             return result.scalars().first()
         except (SQLAlchemyError, Exception) as e:
             if isinstance(e, SQLAlchemyError):
@@ -151,7 +179,7 @@ class UserRepository:
     @classmethod
     async def delete(cls, session: AsyncSession, user_id: str):
         """
-        Delete a user from the database.
+        Delete a user from the database, and from the user cache.
 
         Args:
             session (AsyncSession): The database session.
@@ -163,6 +191,7 @@ class UserRepository:
         try:
             await session.execute(delete(models.User).where(models.User.id == user_id))
             await session.commit()
+            await user_cache.invalidate(user_id)
         except (SQLAlchemyError, Exception) as e:
             if isinstance(e, SQLAlchemyError):
                 msg = "Database Exc: Cannot insert data into table"
@@ -104,6 +104,43 @@ class UserOut(UserBase):
         populate_by_name = True
 
 
+class UserRecord(BaseModel):
+    """
+    Represents the public columns of a user, as kept in the user cache.
+
+    The profile image is the filename, the URL is presigned whenever the user is returned.
+
+    """
+    id: UUID4
+    username: str
+    email: str
+    fullname: str
+    birthdate: date
+    profile_image: str
+    registration_date: date
+    is_active: bool | None
+    last_login: datetime | None
+    verified: bool
+
+    class Config:
+        from_attributes = True
+
+
+class UserPage(BaseModel):
+    """
+    Represents a page of users, ordered by ID.
+
+    Attributes:
+        items (list[UserOut]): The users.
+        next_after_id (UUID4 | None): Pass as after_id to get the next page.
+        has_more (bool): Whether more users may exist.
+
+    """
+    items: list[UserOut]
+    next_after_id: UUID4 | None
+    has_more: bool
+
+
 class UserUpdate(BaseModel):
     id: Annotated[UUID4, Field(..., description="The unique identifier of the user")]
     email: Optional[EmailStr] = Field(default=None, description="The email of the user")
@@ -3,8 +3,9 @@ from typing import Optional
 from pydantic import UUID4
 
 from app.aws.service import AwsS3Service
+from app.user.cache import user_cache
 from app.user.repository import UserRepository
-from app.user.schemas import UserOut, UserCreate, UserUpdate, LoginResponse, ProfileImageOut
+from app.user.schemas import UserOut, UserCreate, UserUpdate, UserPage, UserRecord, LoginResponse, ProfileImageOut
 from app.user.models import User
 from core import exceptions
 
@@ -18,47 +19,44 @@ class UserService:
         self.user_repository = UserRepository()
         self.s3 = AwsS3Service()
 
-    async def get_all_users(self) -> list[UserOut]:
-        result = []
+    async def get_all_users(self, after_id: Optional[UUID4] = None, limit: int = 50) -> UserPage:
         async with UnitOfWork(async_session_factory()) as uow:
-            users = await self.user_repository.find_all(session=uow.session)
-
-        for user in users:
-            user = await self.set_presigned_url_to_user(user)
-            result.append(UserOut.model_validate(user))
-        return result
+            users = await self.user_repository.find_page(session=uow.session, after_id=after_id, limit=limit)
+
+        users = await self.set_presigned_url_to_users(users)
+        items = [UserOut.model_validate(user) for user in users]
+        return UserPage(
+            items=items,
+            next_after_id=items[-1].id if items else None,
+            has_more=len(items) == limit
+        )
 
     async def get_user_by_id(self, user_id: UUID4) -> Optional[UserOut]:
-        async with UnitOfWork(async_session_factory()) as uow:
-            user = await self.user_repository.find_by_id(session=uow.session, user_id=user_id)
-
+        user = await user_cache.get_by_id(
+            user_id, load=lambda: self._load_user(self.user_repository.find_by_id, user_id=user_id)
+        )
         if not user:
             return None
 
-        user = await self.set_presigned_url_to_user(user)
-
-        return UserOut.model_validate(user)
+        return await self._to_user_out(user)
 
     async def get_user_by_username(self, username: str) -> Optional[UserOut]:
-        async with UnitOfWork(async_session_factory()) as uow:
-            user = await self.user_repository.find_by_username(session=uow.session, username=username)
-
+        user = await user_cache.get_by_username(
+            username, load=lambda: self._load_user(self.user_repository.find_by_username, username=username)
+        )
         if not user:
             return None
 
-        user = await self.set_presigned_url_to_user(user)
-
-        return UserOut.model_validate(user)
+        return await self._to_user_out(user)
 
     async def get_user_by_email(self, email: str) -> Optional[UserOut]:
-        async with UnitOfWork(async_session_factory()) as uow:
-            user = await self.user_repository.find_by_email(session=uow.session, email=email)
+        user = await user_cache.get_by_email(
+            email, load=lambda: self._load_user(self.user_repository.find_by_email, email=email)
+        )
         if not user:
             return None
 
-        user = await self.set_presigned_url_to_user(user)
-
-        return UserOut.model_validate(user)
+        return await self._to_user_out(user)
 
     async def create_user(self, user: UserCreate) -> UserOut:
         if await self.get_user_by_username(user.username):
@@ -67,7 +65,7 @@ class UserService:
             raise exceptions.user.DuplicateEmailOrNicknameException()
 
         # hash the password
-        hashed_password = password_helper.hash(user.password)
+        hashed_password = await password_helper.hash_async(user.password)
         user.password = hashed_password
 
         async with UnitOfWork(async_session_factory()) as uow:
@@ -102,7 +100,7 @@ class UserService:
             user = await self.user_repository.find_by_email(session=uow.session, email=email)
         if not user:
             raise exceptions.user.UserNotFoundException()
-        if not password_helper.verify(password, user.password):
+        if not await password_helper.verify_async(password, user.password):
             raise exceptions.user.PasswordDoesNotMatchException()
 
         response = LoginResponse(
@@ -123,7 +121,27 @@ class UserService:
     async def logout(self):
         raise NotImplementedError
 
-    async def set_presigned_url_to_user(self, user: User) -> User:
+    async def _load_user(self, find, **criteria) -> Optional[UserRecord]:
+        async with UnitOfWork(async_session_factory()) as uow:
+            user = await find(session=uow.session, **criteria)
+        return UserRecord.model_validate(user) if user else None
+
+    async def _to_user_out(self, user: UserRecord) -> UserOut:
+        # cached records are shared, the URL goes into a copy
         presigned_url = await self.s3.generate_profile_presigned_url(user.profile_image)
-        user.profile_image = ProfileImageOut(url=presigned_url, filename=user.profile_image)
-        return user
+        return UserOut.model_validate({
+            **user.model_dump(),
+            "profile_image": ProfileImageOut(url=presigned_url, filename=user.profile_image)
+        })
+
+    async def set_presigned_url_to_user(self, user: User) -> User:
+        users = await self.set_presigned_url_to_users([user])
+        return users[0]
+
+    async def set_presigned_url_to_users(self, users: list[User]) -> list[User]:
+        # the same user may be listed several times, e.g. as the addressee of every received request
+        pending = list({id(user): user for user in users if isinstance(user.profile_image, str)}.values())
+        presigned_urls = await self.s3.generate_profile_presigned_urls([user.profile_image for user in pending])
+        for user in pending:
+            user.profile_image = ProfileImageOut(url=presigned_urls[user.profile_image], filename=user.profile_image)
+        return users
@@ -0,0 +1,80 @@
+"""
+Messages per second a worker can store, one insert_one per message against the group-commit batcher.
+
+Every client coroutine sends its messages one after the other and waits for each to be stored, the
+way concurrent POST /chats/ requests do. Both paths also update the inboxes and the search index,
+the batched one is only timed once its indexer has caught up. Messages are written to scratch
+collections of a local mongod.
+
+Usage:
+    python -m benchmarks.chat_ingestion --mongo-uri mongodb://localhost:27017 --clients 1 10 100 --messages 50
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from beanie import init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.chat.batcher import MessageInsertBatcher
+from app.chat.models import Inbox, Message, MessageSearch
+from app.chat.repository import InboxRepository, MessageRepository, MessageSearchRepository
+from core.config import settings
+
+DATABASE = "benchmarks"
+
+
+def make_message(users: list[uuid.UUID], i: int) -> Message:
+    return Message(sender_id=users[i % len(users)], recipient_id=users[(i + 1) % len(users)], content="x" * 64)
+
+
+async def insert_one(message: Message) -> None:
+    await MessageRepository.add(message=message)
+    await InboxRepository.add_message(message=message)
+    await MessageSearchRepository.add_messages(messages=[message])
+
+
+async def run(send, clients: int, messages: int, users: list[uuid.UUID], drain=None) -> float:
+    async def client(offset: int):
+        for i in range(messages):
+            await send(make_message(users, offset + i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(c * messages) for c in range(clients)])
+    if drain is not None:
+        await drain()
+    return clients * messages / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--messages", type=int, default=50, help="messages sent by every client")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.mongo_uri, uuidRepresentation="standard", tz_aware=True)
+    database = client[DATABASE]
+    await init_beanie(database=database, document_models=[Message, Inbox, MessageSearch])
+    users = [uuid.uuid4() for _ in range(1000)]
+    batcher = MessageInsertBatcher(
+        max_delay=settings.mongo_insert_batch_delay,
+        max_batch_size=settings.mongo_insert_batch_size,
+        max_concurrent_batches=settings.mongo_insert_max_concurrent_batches
+    )
+
+    print(f"{'clients':>8} {'insert_one msg/s':>17} {'batched msg/s':>14} {'speedup':>8}")
+    for clients in args.clients:
+        single_rate = await run(insert_one, clients, args.messages, users)
+        # stop waits for the inbox and search updates, the batcher starts again on the next add
+        batched_rate = await run(batcher.add, clients, args.messages, users, drain=batcher.stop)
+        print(f"{clients:>8} {single_rate:>17.0f} {batched_rate:>14.0f} {batched_rate / single_rate:>7.1f}x")
+
+    for collection in (settings.mongo_messages_collection_name, settings.mongo_inbox_collection_name,
+                       settings.mongo_message_search_collection_name):
+        await database.drop_collection(collection)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
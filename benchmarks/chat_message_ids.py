@@ -0,0 +1,72 @@
+"""
+Bulk insert of chat messages with random UUIDv4 ids against time-ordered UUIDv7 ids.
+
+Random ids land on random pages of the _id index, so once the index outgrows the cache every
+insert touches a cold page and pages are split half full. Time-ordered ids are appended to the
+right edge of the index. The benchmark inserts the same messages into two scratch collections
+of a local mongod and reports the insert rate and the size of the _id index of each.
+
+Usage:
+    python -m benchmarks.chat_message_ids --mongo-uri mongodb://localhost:27017 --messages 1000000
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import MongoClient
+
+from app.chat.models import get_conversation_id
+from core.utils.ids import uuid7
+
+DATABASE = "benchmarks"
+
+
+def make_messages(count: int, id_factory) -> list[dict]:
+    users = [uuid.uuid4() for _ in range(100)]
+    messages = []
+    for i in range(count):
+        sender_id, recipient_id = users[i % len(users)], users[(i * 7 + 1) % len(users)]
+        messages.append({
+            "_id": id_factory(),
+            "sender_id": sender_id,
+            "recipient_id": recipient_id,
+            "conversation_id": get_conversation_id(sender_id, recipient_id),
+            "content": "x" * 64,
+            "created_at": datetime.now(timezone.utc),
+        })
+    return messages
+
+
+def insert(collection, messages: list[dict], batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(messages), batch_size):
+        collection.insert_many(messages[i:i + batch_size], ordered=False)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=1000, help="messages per insert_many")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri, uuidRepresentation="standard")
+    database = client[DATABASE]
+
+    print(f"{'ids':>6} {'messages/s':>11} {'_id index MiB':>14} {'bytes/message':>14}")
+    for name, id_factory in (("uuid4", uuid.uuid4), ("uuid7", uuid7)):
+        collection = database[f"messages_{name}"]
+        collection.drop()
+        messages = make_messages(args.messages, id_factory)
+
+        elapsed = insert(collection, messages, args.batch)
+        index_size = database.command("collStats", collection.name)["indexSizes"]["_id_"]
+        print(f"{name:>6} {args.messages / elapsed:>11.0f} {index_size / 2 ** 20:>14.1f} "
+              f"{index_size / args.messages:>14.1f}")
+        collection.drop()
+
+
+if __name__ == "__main__":
+    main()
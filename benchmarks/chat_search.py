@@ -0,0 +1,108 @@
+"""
+Latency of /chats/search for a user with a long chat history.
+
+Generates synthetic conversations with Faker, the way the test suite generates users, for one
+heavy user talking to many friends, indexes them like the insert batcher does and runs searches
+for words of the generated vocabulary through MessageSearchRepository. Messages are spread over
+--days of history, as the search reads recent time windows first. Reports the latency percentiles
+of the first page and of the following one. Data goes to scratch collections of a local mongod.
+
+Usage:
+    python -m benchmarks.chat_search --mongo-uri mongodb://localhost:27017 --messages 100000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from beanie import init_beanie
+from faker import Faker
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.chat.models import Inbox, Message, MessageSearch
+from app.chat.repository import MessageRepository, MessageSearchRepository
+from core.config import settings
+from core.utils.ids import uuid7_lower_bound
+
+DATABASE = "benchmarks"
+BATCH = 5000
+
+fake = Faker()
+
+
+def make_messages(user_id: uuid.UUID, friends: list[uuid.UUID], count: int, days: int) -> list[Message]:
+    messages = []
+    now = time.time()
+    for _ in range(count):
+        friend_id = random.choice(friends)
+        sender_id, recipient_id = random.choice([(user_id, friend_id), (friend_id, user_id)])
+        # spread over the history, ids keep their creation time like uuid7 does
+        created_at = now - random.uniform(0, days * 86400)
+        message_id = uuid.UUID(int=uuid7_lower_bound(created_at).int | random.getrandbits(62))
+        messages.append(Message(
+            id=message_id,
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            content=fake.sentence(nb_words=12),
+            created_at=datetime.fromtimestamp(created_at, timezone.utc)
+        ))
+    return messages
+
+
+def percentile(samples: list[float], q: int) -> float:
+    return statistics.quantiles(samples, n=100)[q - 1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--messages", type=int, default=100000, help="messages of the searching user")
+    parser.add_argument("--friends", type=int, default=200)
+    parser.add_argument("--days", type=int, default=730, help="length of the chat history")
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.mongo_uri, uuidRepresentation="standard", tz_aware=True)
+    database = client[DATABASE]
+    await init_beanie(database=database, document_models=[Message, Inbox, MessageSearch])
+
+    user_id = uuid.uuid4()
+    friends = [uuid.uuid4() for _ in range(args.friends)]
+    for i in range(0, args.messages, BATCH):
+        messages = make_messages(user_id, friends, min(BATCH, args.messages - i), args.days)
+        await MessageRepository.add_bulk(messages=messages)
+        await MessageSearchRepository.add_messages(messages=messages)
+
+    first_page, next_page = [], []
+    for _ in range(args.searches):
+        query = fake.word()
+
+        start = time.perf_counter()
+        message_ids = await MessageSearchRepository.find_message_ids(
+            owner_id=user_id, query=query, before=None, limit=args.limit
+        )
+        await MessageRepository.find_by_ids(message_ids=message_ids)
+        first_page.append(time.perf_counter() - start)
+
+        if message_ids:
+            start = time.perf_counter()
+            await MessageSearchRepository.find_message_ids(
+                owner_id=user_id, query=query, before=message_ids[-1], limit=args.limit
+            )
+            next_page.append(time.perf_counter() - start)
+
+    print(f"{'page':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, samples in (("first", first_page), ("next", next_page)):
+        print(f"{name:>6} {percentile(samples, 50) * 1000:>8.1f} {percentile(samples, 95) * 1000:>8.1f} "
+              f"{percentile(samples, 99) * 1000:>8.1f}")
+
+    for collection in (settings.mongo_messages_collection_name, settings.mongo_message_search_collection_name):
+        await database.drop_collection(collection)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
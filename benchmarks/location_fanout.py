@@ -0,0 +1,85 @@
+"""
+CPU cost of fanning out one location update to the connected SSE clients of a worker.
+
+Compares the old single global channel, where every subscriber receives every update and
+filters it with a substring check, against per-user channels, where only the subscribers of
+the moving user receive it. Redis is not involved, the benchmark models the work each
+subscriber does in the worker process once a message has been read from the socket.
+
+Usage:
+    python -m benchmarks.location_fanout --clients 10 100 1000 10000 --friends 20
+"""
+import argparse
+import random
+import time
+import uuid
+from collections import defaultdict
+
+from app.location.schemas import LocationInRedis
+
+
+def make_update(user_id: str) -> bytes:
+    location = LocationInRedis(user_id=user_id, longitude=random.uniform(-180, 180), latitude=random.uniform(-85, 85))
+    return location.model_dump_json().encode()
+
+
+def global_channel(subscriptions: list[tuple[int, str]], updates: list[tuple[str, bytes]]) -> int:
+    delivered = 0
+    for _, payload in updates:
+        for _, watched_user_id in subscriptions:
+            if watched_user_id in payload.decode():
+                delivered += 1
+    return delivered
+
+
+def subscribe_per_user(subscriptions: list[tuple[int, str]]) -> dict[str, list[int]]:
+    channels = defaultdict(list)
+    for client, watched_user_id in subscriptions:
+        channels[watched_user_id].append(client)
+    return channels
+
+
+def per_user_channels(channels: dict[str, list[int]], updates: list[tuple[str, bytes]]) -> int:
+    delivered = 0
+    for user_id, payload in updates:
+        for _ in channels.get(user_id, ()):
+            payload.decode()
+            delivered += 1
+    return delivered
+
+
+def measure(fanout, subscriptions, updates) -> tuple[float, int]:
+    start = time.process_time()
+    delivered = fanout(subscriptions, updates)
+    return (time.process_time() - start) / len(updates), delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--friends", type=int, default=20, help="users watched by every client")
+    parser.add_argument("--movers", type=int, default=1000, help="users sending updates")
+    parser.add_argument("--updates", type=int, default=200)
+    args = parser.parse_args()
+
+    movers = [str(uuid.uuid4()) for _ in range(args.movers)]
+    updates = [(user_id, make_update(user_id)) for user_id in random.choices(movers, k=args.updates)]
+
+    print(f"{'clients':>8} {'global us/update':>18} {'per-user us/update':>20} {'speedup':>8}")
+    for clients in args.clients:
+        # every client streams a subset of the movers, one subscription per watched friend
+        subscriptions = [
+            (client, user_id)
+            for client in range(clients)
+            for user_id in random.sample(movers, k=min(args.friends, len(movers)))
+        ]
+        global_cost, global_delivered = measure(global_channel, subscriptions, updates)
+        per_user_cost, per_user_delivered = measure(per_user_channels, subscribe_per_user(subscriptions), updates)
+        assert global_delivered == per_user_delivered
+
+        print(f"{clients:>8} {global_cost * 1e6:>18.1f} {per_user_cost * 1e6:>20.1f} "
+              f"{global_cost / per_user_cost:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
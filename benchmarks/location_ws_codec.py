@@ -0,0 +1,78 @@
+"""
+Frames per second the location websocket can take in with JSON and with the binary subprotocol.
+
+Each side models the work done in the worker between receiving a websocket message and handing
+the payload to Redis: the JSON path parses the message, validates it with Pydantic and serialises
+the published location to JSON, the binary path unpacks the frames and packs the Redis message.
+Redis and the socket are not involved.
+
+Usage:
+    python -m benchmarks.location_ws_codec --messages 100000 --batch 1 10
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+from app.location.codec import FRAME, LocationFrame, decode_frames, encode_message
+from app.location.schemas import LocationBase, LocationInRedis
+
+
+def make_points(count: int) -> list[tuple[float, float, float, float]]:
+    return [
+        (random.uniform(-85, 85), random.uniform(-180, 180), time.time(), random.uniform(1, 50))
+        for _ in range(count)
+    ]
+
+
+def json_path(messages: list[str], user_id: uuid.UUID) -> int:
+    for message in messages:
+        location = json.loads(message)
+        points = location if isinstance(location, list) else [location]
+        locations = [LocationFrame.from_location(LocationBase(**point)) for point in points]
+        latest = locations[-1]
+        LocationInRedis(user_id=user_id, longitude=latest.longitude, latitude=latest.latitude).model_dump_json()
+    return len(messages)
+
+
+def binary_path(messages: list[bytes], user_id: uuid.UUID) -> int:
+    for message in messages:
+        locations = decode_frames(message)
+        encode_message(user_id=user_id, frame=locations[-1])
+    return len(messages)
+
+
+def measure(path, messages, user_id) -> float:
+    start = time.process_time()
+    count = path(messages, user_id)
+    return count / (time.process_time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 10], help="points per message")
+    args = parser.parse_args()
+
+    user_id = uuid.uuid4()
+
+    print(f"{'batch':>6} {'json bytes':>11} {'binary bytes':>13} {'json msg/s':>12} {'binary msg/s':>13} {'speedup':>8}")
+    for batch in args.batch:
+        batches = [make_points(batch) for _ in range(args.messages)]
+        json_messages = [
+            json.dumps([{"latitude": lat, "longitude": lon} for lat, lon, _, _ in points]) for points in batches
+        ]
+        binary_messages = [b"".join(FRAME.pack(*point) for point in points) for points in batches]
+
+        json_rate = measure(json_path, json_messages, user_id)
+        binary_rate = measure(binary_path, binary_messages, user_id)
+        json_size = sum(map(len, json_messages)) / len(json_messages)
+        binary_size = sum(map(len, binary_messages)) / len(binary_messages)
+
+        print(f"{batch:>6} {json_size:>11.0f} {binary_size:>13.0f} {json_rate:>12.0f} {binary_rate:>13.0f} "
+              f"{binary_rate / json_rate:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
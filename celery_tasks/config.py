@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.schedules import crontab
 
 from core.config import settings
 
@@ -6,4 +7,12 @@ redis_celery_tasks_url = f"redis://{settings.redis_host}:{settings.redis_port}/{
 redis_celery_tasks_backend = f"redis://{settings.redis_host}:{settings.redis_port}/{settings.redis_celery_backend_db}"
 
 
-celery = Celery('tasks', broker=redis_celery_tasks_url, backend=redis_celery_tasks_backend)
+celery = Celery('tasks', broker=redis_celery_tasks_url, backend=redis_celery_tasks_backend,
+                include=['celery_tasks.tasks.chat'])
+
+celery.conf.beat_schedule = {
+    'archive-old-chat-messages': {
+        'task': 'chat.archive_old_messages',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
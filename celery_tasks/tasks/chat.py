@@ -0,0 +1,28 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.chat.archive import message_archiver
+from celery_tasks.config import celery
+from core.config import settings
+from core.db.mongo_session import close_motor_client, init_db_beanie
+
+
+@celery.task(name='chat.archive_old_messages')
+def archive_old_messages() -> int:
+    """
+    Move the chat messages older than chat_archive_after_days to the archive, scheduled nightly.
+
+    Returns:
+        int: The number of archived messages.
+    """
+    return asyncio.run(_archive_old_messages())
+
+
+async def _archive_old_messages() -> int:
+    # every run has its own event loop, the Motor client can't outlive it
+    await init_db_beanie()
+    try:
+        created_before = datetime.now(timezone.utc) - timedelta(days=settings.chat_archive_after_days)
+        return await message_archiver.archive(created_before=created_before)
+    finally:
+        close_motor_client()
@@ -18,11 +18,35 @@ class Settings(BaseSettings):
     jwt_algorithm: str
     jwt_token_expire_minutes: int
 
+    password_hash_workers: int = 4  # threads hashing passwords, bcrypt releases the GIL
+    password_hash_max_queue: int = 32  # password checks waiting for a thread before new ones are rejected
+    password_hash_max_wait: float = 2  # seconds a password check may wait for a thread before it is dropped
+
     redis_host: str
     redis_port: str
     redis_celery_broker_db: str
     redis_celery_backend_db: str
     redis_location_channel: str
+    redis_location_geo_key: str = "location:geo"
+    redis_location_stream_max_len: int = 100  # updates per user kept for replay
+    redis_location_stream_ttl: int = 3600  # seconds a stream of an inactive user is kept
+    redis_pubsub_queue_size: int = 100  # messages buffered per stream before dropping the oldest
+
+    metrics_port: int = 9100  # port of the Prometheus metrics server, 0 to disable
+
+    location_flush_interval: float = 5  # seconds
+    location_flush_max_batch_size: int = 1000  # rows per INSERT, at most 8000 to fit asyncpg bind parameters
+    location_history_retention_days: int = 30
+    location_history_partitions_ahead: int = 2  # daily partitions created in advance
+    location_nearby_max_radius: int = 50000  # meters
+    location_publish_min_distance: float = 10  # meters moved before an update is published again
+    location_publish_max_interval: float = 30  # seconds after which an update is published even if not moved
+    location_viewport_cluster_max_zoom: int = 12  # highest map zoom at which friends are clustered
+
+    user_cache_ttl: int = 300  # seconds a user is kept in Redis
+    user_cache_local_ttl: float = 30  # seconds a user is kept in the memory of a worker
+    user_cache_local_size: int = 10000  # users kept in the memory of a worker
+    user_cache_tombstone_ttl: int = 5  # seconds after an update during which the user is not cached again
 
     s3_access_key: str
     s3_secret_access_key: str
@@ -34,6 +58,22 @@ class Settings(BaseSettings):
     mongo_cluster_name: str = Field(..., env="mongo_cluster_name")
     mongo_chat_database_name: str = Field(..., env="mongo_chat_database_name")
     mongo_messages_collection_name: str = Field(..., env="mongo_messages_collection_name")
+    mongo_inbox_collection_name: str = "inbox"
+    mongo_message_search_collection_name: str = "message_search"
+    mongo_max_pool_size: int = 100  # connections per process
+    mongo_min_pool_size: int = 0
+    mongo_wait_queue_timeout_ms: int = 5000  # fail a request instead of queueing forever for a connection
+    mongo_insert_batch_delay: float = 0.005  # seconds a message waits for others to be inserted with
+    mongo_insert_batch_size: int = 500  # messages per insert_many
+    mongo_insert_max_concurrent_batches: int = 4  # insert_many calls in flight, further batches wait
+    mongo_stream_queue_size: int = 1000  # messages buffered per chat stream before it is closed
+    mongo_message_archive_collection_name: str = "message_archive"
+
+    chat_archive_after_days: int = 180  # messages older than this are moved out of MongoDB
+    chat_archive_chunk_size: int = 1000  # messages per archive blob
+    chat_archive_storage: str = "local"  # "local" or "s3"
+    chat_archive_path: str = "chat_archive"  # directory of the local archive
+    chat_archive_cache_size: int = 64  # decoded archive blobs kept in memory per process
 
     email_host: str = Field(..., env="email_host")
     email_port: str = Field(..., env="email_port")
@@ -49,6 +89,11 @@ class Settings(BaseSettings):
     aws_access_key: str = Field(..., env="AWS_ACCESS_KEY")
     aws_secret_access_key: str = Field(..., env="AWS_SECRET_ACCESS_KEY")
     aws_s3_profile_image_bucket: str = Field(..., env="AWS_S3_PROFILE_IMAGE_BUCKET")
+    aws_s3_chat_archive_bucket: str = Field("", env="AWS_S3_CHAT_ARCHIVE_BUCKET")
+    aws_presigned_url_expires_in: int = 3600  # seconds a presigned URL is valid
+    aws_presigned_url_cache_margin: int = 300  # seconds before its expiry a cached URL is no longer handed out
+    aws_presigned_url_cache_size: int = 10000  # URLs kept in memory per process
+    aws_presigned_url_cache_redis: bool = True  # share presigned URLs between processes through Redis
 
     class Config:
         env_file = ".env-dev"
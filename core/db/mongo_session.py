@@ -1,20 +1,122 @@
+import threading
+import time
+
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
 
-from app.chat.models import Message
+from app.chat.models import Inbox, Message, MessageArchive, MessageSearch
+from app.chat.repository import MessageRepository
 from core.config import settings
 
 MONGO_DATABASE_URI = f"mongodb+srv://{settings.mongo_username}:{settings.mongo_password}@{settings.mongo_cluster_name}.oxr76f3.mongodb.net/?retryWrites=true&w=majority"
 
+pool_checkout_seconds = Histogram(
+    "mongo_pool_checkout_seconds",
+    "Time spent waiting for a connection of the MongoDB pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+pool_checkout_failures = Counter(
+    "mongo_pool_checkout_failures_total", "Failed checkouts of a MongoDB connection", ["reason"]
+)
+pool_connections_in_use = Gauge("mongo_pool_connections_in_use", "MongoDB connections checked out of the pool")
+pool_connections_open = Gauge("mongo_pool_connections_open", "MongoDB connections opened by the pool")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Exports the connection pool events of the Motor client as Prometheus metrics.
+
+    A checkout runs synchronously in the thread that requested it, so its start time is kept in a
+    thread local until the connection is handed out.
+    """
+
+    def __init__(self):
+        self._checkout = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._checkout.started_at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._observe_checkout()
+        pool_connections_in_use.inc()
+
+    def connection_check_out_failed(self, event):
+        self._observe_checkout()
+        pool_checkout_failures.labels(reason=event.reason).inc()
+
+    def connection_checked_in(self, event):
+        pool_connections_in_use.dec()
+
+    def connection_created(self, event):
+        pool_connections_open.inc()
+
+    def connection_closed(self, event):
+        pool_connections_open.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def _observe_checkout(self) -> None:
+        # missing when the listener was not told when this thread started the checkout
+        started_at = getattr(self._checkout, "started_at", None)
+        if started_at is None:
+            return
+        self._checkout.started_at = None
+        pool_checkout_seconds.observe(time.perf_counter() - started_at)
+
+
+_client: AsyncIOMotorClient | None = None
+
+
+def get_motor_client() -> AsyncIOMotorClient:
+    """
+    The Motor client of the process, created on first use.
+
+    Every client has its own connection pool and monitoring threads, so the whole process shares one.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            MONGO_DATABASE_URI,
+            uuidRepresentation="standard",
+            tz_aware=True,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+            event_listeners=[PoolMetricsListener()]
+        )
+    return _client
+
 
-def get_motor_client():
-    return AsyncIOMotorClient(MONGO_DATABASE_URI, uuidRepresentation="standard")
+def close_motor_client() -> None:
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
 
 
 async def init_db_beanie():
     client = get_motor_client()
 
-    await init_beanie(database=client[settings.mongo_chat_database_name], document_models=[Message])
+    await init_beanie(
+        database=client[settings.mongo_chat_database_name],
+        document_models=[Message, Inbox, MessageSearch, MessageArchive]
+    )
+    await MessageRepository.set_missing_conversation_ids()
 
 
 async def get_message_collection() -> AsyncIOMotorCollection:
@@ -23,4 +125,4 @@ async def get_message_collection() -> AsyncIOMotorCollection:
         db = client[settings.mongo_chat_database_name]
         return db[settings.mongo_messages_collection_name]
     except Exception:
-        raise ConnectionError("Error in connection to Chat DB")
\ No newline at end of file
+        raise ConnectionError("Error in connection to Chat DB")
@@ -14,7 +14,8 @@ from .user import (
     UserNotFoundException,
     UserNotVerified,
     InsufficientPermissions,
-    UserAgeInvalid
+    UserAgeInvalid,
+    PasswordHashingOverloaded
 )
 from .friends import (
     AlreadySentRequest,
@@ -25,9 +26,13 @@ from .friends import (
 
 from .chat import (
     MessageToSelfException,
-    MessageToNonFriendException
+    MessageToNonFriendException,
+    MessageNotFound,
+    MessageNotSaved
 )
 
+from .location import LocationNotFound, InvalidBoundingBox
+
 __all__ = [
     "CustomException",
     "BadRequestException",
@@ -47,8 +52,13 @@ __all__ = [
     "AlreadyFriends",
     "InsufficientPermissions",
     "UserAgeInvalid",
+    "PasswordHashingOverloaded",
     "TokenException",
     "MessageToSelfException",
     "MessageToNonFriendException",
-    "UsersNotFriends"
+    "MessageNotFound",
+    "MessageNotSaved",
+    "UsersNotFriends",
+    "LocationNotFound",
+    "InvalidBoundingBox"
 ]
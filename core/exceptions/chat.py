@@ -12,3 +12,14 @@ class MessageToNonFriendException(CustomException):
     error_code = "MESSAGE_TO_NON_FRIEND"
     message = "cannot send message to non friend"
 
+
+class MessageNotFound(CustomException):
+    code = 404
+    error_code = "MESSAGE__NOT_FOUND"
+    message = "message not found"
+
+
+class MessageNotSaved(CustomException):
+    code = 500
+    error_code = "MESSAGE__NOT_SAVED"
+    message = "message could not be saved"
@@ -0,0 +1,13 @@
+from core.exceptions.base import CustomException
+
+
+class LocationNotFound(CustomException):
+    code = 404
+    error_code = "LOCATION__NOT_FOUND"
+    message = "location not found"
+
+
+class InvalidBoundingBox(CustomException):
+    code = 400
+    error_code = "LOCATION__INVALID_BOUNDING_BOX"
+    message = "bbox must be min_longitude,min_latitude,max_longitude,max_latitude"
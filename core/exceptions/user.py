@@ -35,4 +35,10 @@ class UserAgeInvalid(CustomException):
 class InsufficientPermissions(CustomException):
     code = status.HTTP_403_FORBIDDEN
     error_code = "USER__INSUFFICIENT_PERMISSIONS"
-    message = "insufficient permissions"
\ No newline at end of file
+    message = "insufficient permissions"
+
+
+class PasswordHashingOverloaded(CustomException):
+    code = status.HTTP_503_SERVICE_UNAVAILABLE
+    error_code = "USER__PASSWORD_HASHING_OVERLOADED"
+    message = "too many password checks, retry later"
@@ -0,0 +1,173 @@
+import asyncio
+from collections import defaultdict
+
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError
+
+from core.config import settings
+from core.redis.session import get_redis_connection
+
+RECONNECT_DELAY = 1  # second
+
+dispatched_messages = Counter(
+    "redis_pubsub_dispatched_messages_total",
+    "Messages read from Redis pub/sub and handed to subscriptions"
+)
+dropped_messages = Counter(
+    "redis_pubsub_dropped_messages_total",
+    "Messages discarded because the queue of a slow subscription was full"
+)
+queue_depth = Histogram(
+    "redis_pubsub_queue_depth",
+    "Depth of the subscription queue right after a message was put into it",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+subscriptions_count = Gauge("redis_pubsub_subscriptions", "Open subscriptions of the worker")
+channels_count = Gauge("redis_pubsub_channels", "Redis channels the worker is subscribed to")
+queued_messages = Gauge("redis_pubsub_queued_messages", "Messages waiting in all subscription queues")
+
+
+class PubSubSubscription:
+    """
+    A single consumer of the multiplexer, typically one SSE connection.
+
+    Messages of all the channels of the subscription end up in one bounded queue. When the consumer
+    can't keep up the oldest message is dropped, for live data only the newest one is worth sending.
+
+    Usage:
+        async with multiplexer.subscription("channel:a", "channel:b") as subscription:
+            async for channel, data in subscription:
+                ...
+    """
+
+    def __init__(self, multiplexer: "RedisPubSubMultiplexer", channels: tuple[str, ...], queue_size: int):
+        self.multiplexer = multiplexer
+        self.channels: set[str] = set()
+        self.queue: asyncio.Queue[tuple[str, bytes]] = asyncio.Queue(maxsize=queue_size)
+        self._initial_channels = channels
+
+    async def __aenter__(self) -> "PubSubSubscription":
+        await self.multiplexer.add_channels(self, *self._initial_channels)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.multiplexer.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple[str, bytes]:
+        return await self.queue.get()
+
+    def put(self, channel: str, data: bytes) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            dropped_messages.inc()
+        self.queue.put_nowait((channel, data))
+        queue_depth.observe(self.queue.qsize())
+
+
+class RedisPubSubMultiplexer:
+    """
+    Shares one Redis pub/sub connection between every subscription of the worker process.
+
+    A single reader task blocks on the connection and dispatches each message to the subscriptions
+    of its channel. A channel is subscribed in Redis when its first subscription is opened and
+    unsubscribed when its last one is closed.
+    """
+
+    def __init__(self, redis: Redis, queue_size: int):
+        self.redis = redis
+        self.queue_size = queue_size
+        self._pubsub = redis.pubsub()
+        self._subscriptions: dict[str, set[PubSubSubscription]] = defaultdict(set)
+        self._lock = asyncio.Lock()
+        self._reader: asyncio.Task | None = None
+
+        subscriptions_count.set_function(self._count_subscriptions)
+        channels_count.set_function(lambda: len(self._subscriptions))
+        queued_messages.set_function(self._count_queued_messages)
+
+    def subscription(self, *channels: str) -> PubSubSubscription:
+        return PubSubSubscription(self, channels, self.queue_size)
+
+    async def add_channels(self, subscription: PubSubSubscription, *channels: str) -> None:
+        async with self._lock:
+            new_channels = [channel for channel in channels if channel not in self._subscriptions]
+            if new_channels:
+                # a failed SUBSCRIBE leaves nothing behind, the next subscription tries the channels again
+                await self._pubsub.subscribe(*new_channels)
+
+            for channel in channels:
+                self._subscriptions[channel].add(subscription)
+                subscription.channels.add(channel)
+
+            # the connection only exists after the first SUBSCRIBE
+            if self._subscriptions and (self._reader is None or self._reader.done()):
+                self._reader = asyncio.create_task(self._read())
+
+    async def remove_channels(self, subscription: PubSubSubscription, *channels: str) -> None:
+        async with self._lock:
+            stale_channels = []
+            for channel in channels:
+                subscription.channels.discard(channel)
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[channel]
+                    stale_channels.append(channel)
+
+            if stale_channels:
+                await self._pubsub.unsubscribe(*stale_channels)
+
+    async def unsubscribe(self, subscription: PubSubSubscription) -> None:
+        await self.remove_channels(subscription, *list(subscription.channels))
+
+    async def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        await self._pubsub.aclose()
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            except ConnectionError as e:
+                # the connection resubscribes to every channel once it reconnects
+                logger.error(f"Redis pub/sub connection lost: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            except Exception as e:
+                # the reader serves every subscription of the worker, it must outlive any single error
+                logger.error(f"Redis pub/sub message could not be read: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            if message is None or message["type"] != "message":
+                continue
+
+            channel = message["channel"].decode()
+            for subscription in self._subscriptions.get(channel, ()):
+                subscription.put(channel, message["data"])
+            dispatched_messages.inc()
+
+    def _all_subscriptions(self) -> set[PubSubSubscription]:
+        return {subscription for subscribers in self._subscriptions.values() for subscription in subscribers}
+
+    def _count_subscriptions(self) -> int:
+        return len(self._all_subscriptions())
+
+    def _count_queued_messages(self) -> int:
+        return sum(subscription.queue.qsize() for subscription in self._all_subscriptions())
+
+
+pubsub_multiplexer = RedisPubSubMultiplexer(redis=get_redis_connection(), queue_size=settings.redis_pubsub_queue_size)
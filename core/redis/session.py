@@ -6,7 +6,10 @@ from redis.asyncio import Redis
 from core.config import settings
 
 
+# one pool per process, every client borrows its connections from it
+pool = redis.ConnectionPool(host=settings.redis_host, port=settings.redis_port, db="2")
+
+
 def get_redis_connection():
-    pool = redis.ConnectionPool(host=settings.redis_host, port=settings.redis_port, db="2")
-    client = redis.Redis.from_pool(pool)
+    client = redis.Redis(connection_pool=pool)
     return client
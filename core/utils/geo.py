@@ -0,0 +1,83 @@
+from math import asin, cos, radians, sin, sqrt
+from typing import Sequence
+
+EARTH_RADIUS = 6371008.8  # meters, mean radius
+
+
+def haversine_distances(
+        longitude: float,
+        latitude: float,
+        longitudes: Sequence[float],
+        latitudes: Sequence[float]
+) -> list[float]:
+    """
+    Great-circle distances from one point to many points.
+
+    The terms depending only on the origin are computed once for the whole batch.
+
+    Args:
+        longitude (float): Longitude of the origin in degrees.
+        latitude (float): Latitude of the origin in degrees.
+        longitudes (Sequence[float]): Longitudes of the points in degrees.
+        latitudes (Sequence[float]): Latitudes of the points in degrees, same length as longitudes.
+
+    Returns:
+        list[float]: Distance in meters from the origin to every point.
+    """
+    origin_longitude, origin_latitude = radians(longitude), radians(latitude)
+    origin_latitude_cos = cos(origin_latitude)
+
+    distances = []
+    for point_longitude, point_latitude in zip(longitudes, latitudes):
+        point_longitude, point_latitude = radians(point_longitude), radians(point_latitude)
+        a = sin((point_latitude - origin_latitude) / 2) ** 2 + \
+            origin_latitude_cos * cos(point_latitude) * sin((point_longitude - origin_longitude) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS * asin(min(1.0, sqrt(a))))
+    return distances
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(longitude: float, latitude: float, precision: int) -> str:
+    """
+    Base32 geohash of a point.
+
+    Points sharing a prefix lie in the same cell, every extra character divides the cell into 32.
+
+    Args:
+        longitude (float): Longitude in degrees.
+        latitude (float): Latitude in degrees.
+        precision (int): Number of characters.
+
+    Returns:
+        str: The geohash.
+    """
+    longitude_range, latitude_range = [-180.0, 180.0], [-90.0, 90.0]
+    geohash, bits, value, even = [], 0, 0, True
+    while len(geohash) < precision:
+        coordinate, interval = (longitude, longitude_range) if even else (latitude, latitude_range)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(geohash)
+
+
+def geohash_precision_for_zoom(zoom: int) -> int:
+    """
+    Geohash length whose cells are about a quarter of a web map tile wide at the zoom level.
+
+    A tile spans 360 / 2^zoom degrees of longitude and a geohash of n characters has ceil(5n / 2)
+    longitude bits, so the cell count per viewport stays the same at every zoom level.
+    """
+    return max(1, min(12, round(2 * (zoom + 2) / 5)))
@@ -1,7 +1,32 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
 from passlib.context import CryptContext
+from prometheus_client import Counter, Gauge, Histogram
+
+from core.config import settings
+from core.exceptions import PasswordHashingOverloaded
 
 pwd_context = CryptContext(schemes=["bcrypt"])
 
+T = TypeVar("T")
+
+queue_depth = Gauge("password_hash_queue_depth", "Password checks waiting for a thread")
+wait_seconds = Histogram(
+    "password_hash_wait_seconds",
+    "Time a password check waited for a thread",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+run_seconds = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing or verifying a password",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+rejected = Counter("password_hash_rejected_total", "Password checks rejected because of load", ["reason"])
+
 
 def hash(password: str):
     """
@@ -28,3 +53,108 @@ def verify(plain_password: str, hashed_password: str):
         bool: True if the plain password matches the hashed password, False otherwise.
     """
     return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordExecutor:
+    """
+    Bounded thread pool running bcrypt off the event loop.
+
+    A bcrypt call takes tens of milliseconds and would stall every connection of the worker, and it
+    releases the GIL, so threads hash in parallel. At most max_workers calls run at once and max_queue
+    wait for a thread. Beyond that a call is rejected right away, and a call that waited more than
+    max_wait seconds is dropped before hashing, its client has likely given up. During a login storm
+    clients get a fast error instead of an ever-growing backlog.
+
+    Attributes:
+        max_workers (int): Threads hashing passwords.
+        max_queue (int): Calls allowed to wait for a thread.
+        max_wait (float): Seconds a call may wait for a thread.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, max_wait: float):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._executor: ThreadPoolExecutor | None = None
+        # updated from the event loop and from the threads
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._queued = 0
+
+        queue_depth.set_function(lambda: self._queued)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """
+        Run a password function in the pool.
+
+        Raises:
+            PasswordHashingOverloaded: If the pool is full or the call waited too long for a thread.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                rejected.labels(reason="queue_full").inc()
+                raise PasswordHashingOverloaded()
+            self._pending += 1
+            self._queued += 1
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password")
+
+        future = self._executor.submit(self._call, time.perf_counter(), fn, *args)
+        # also called when a waiting call is cancelled, so the slot is released either way
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _call(self, submitted_at: float, fn: Callable[..., T], *args) -> T:
+        started_at = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+        wait_seconds.observe(started_at - submitted_at)
+
+        if started_at - submitted_at > self.max_wait:
+            rejected.labels(reason="timeout").inc()
+            raise PasswordHashingOverloaded()
+
+        try:
+            return fn(*args)
+        finally:
+            run_seconds.observe(time.perf_counter() - started_at)
+
+    def _release(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled():
+                # never started
+                self._queued -= 1
+
+
+password_executor = PasswordExecutor(
+    max_workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue,
+    max_wait=settings.password_hash_max_wait
+)
+
+
+async def hash_async(password: str) -> str:
+    """
+    Hashes a password in the password thread pool.
+
+    Raises:
+        PasswordHashingOverloaded: If too many passwords are being checked.
+    """
+    return await password_executor.run(hash, password)
+
+
+async def verify_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verifies a password in the password thread pool.
+
+    Raises:
+        PasswordHashingOverloaded: If too many passwords are being checked.
+    """
+    return await password_executor.run(verify, plain_password, hashed_password)
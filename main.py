@@ -2,6 +2,7 @@ from typing import List
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import start_http_server
 from starlette.middleware import Middleware
 from starlette.responses import JSONResponse
 
@@ -11,9 +12,17 @@ from api.location import location_router
 from api.user import users_router
 from api.friends import friends_router
 from api.aws import aws_router
-from core.db.mongo_session import init_db_beanie
+from app.aws.service import AwsS3Service
+from app.chat.batcher import message_insert_batcher
+from app.chat.dispatcher import message_change_stream_dispatcher
+from app.location.write_behind import location_write_behind_buffer
+from app.user.cache import user_cache
+from core.config import settings
+from core.db.mongo_session import close_motor_client, init_db_beanie
 from core.exceptions import CustomException
 from core.fastapi.middlewares.auth_middleware import AuthenticationMiddleware, AuthBackend
+from core.redis.pubsub import pubsub_multiplexer
+from core.utils.password_helper import password_executor
 
 # index file
 from celery_tasks.config import celery
@@ -93,7 +102,25 @@ app = create_app()
 
 @app.on_event("startup")
 async def startup_event():
+    # metrics are served on their own port, reachable by Prometheus but not published with the API
+    if settings.metrics_port:
+        start_http_server(settings.metrics_port)
     await init_db_beanie()
+    await AwsS3Service().start()
+    user_cache.start()
+    location_write_behind_buffer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await user_cache.stop()
+    await pubsub_multiplexer.stop()
+    await message_change_stream_dispatcher.stop()
+    await message_insert_batcher.stop()
+    close_motor_client()
+    await AwsS3Service().stop()
+    await location_write_behind_buffer.stop()
+    password_executor.shutdown()
 
 
 @app.get("/")
@@ -1,8 +1,14 @@
+import asyncio
+import threading
+import time
 from datetime import datetime
 
+import pytest
+
 from .conftest import UserFactory, fake
 
-from core.exceptions import PasswordDoesNotMatchException
+from core.exceptions import PasswordDoesNotMatchException, PasswordHashingOverloaded
+from core.utils.password_helper import PasswordExecutor, hash_async, verify_async
 
 
 async def test_Login_Success(async_client, session):
@@ -38,3 +44,44 @@ async def test_Login_InvalidPassword(async_client, session):
     res = await async_client.post("/auth/login", data={"username": data["email"], "password": "wrong_password"})
 
     assert res.status_code == PasswordDoesNotMatchException.code
+
+
+async def test_PasswordExecutor_RejectsWhenFull():
+    executor = PasswordExecutor(max_workers=1, max_queue=1, max_wait=5)
+    release = threading.Event()
+    try:
+        running = asyncio.create_task(executor.run(release.wait))
+        queued = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0)
+
+        with pytest.raises(PasswordHashingOverloaded):
+            await executor.run(release.wait)
+
+        release.set()
+        assert await running and await queued
+        # the slots are released once the calls finish
+        assert await executor.run(lambda: True)
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+async def test_PasswordExecutor_DropsCallsWaitingTooLong():
+    executor = PasswordExecutor(max_workers=1, max_queue=1, max_wait=0.05)
+    try:
+        running = asyncio.create_task(executor.run(time.sleep, 0.2))
+        await asyncio.sleep(0)
+
+        with pytest.raises(PasswordHashingOverloaded):
+            await executor.run(lambda: True)
+
+        await running
+    finally:
+        executor.shutdown()
+
+
+async def test_PasswordHelper_HashAndVerifyAsync():
+    hashed = await hash_async("1233513tg")
+
+    assert await verify_async("1233513tg", hashed)
+    assert not await verify_async("wrong_password", hashed)
@@ -0,0 +1,199 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from app.chat.archive import LocalArchiveStorage, MessageArchiver, decode_messages, encode_messages
+from app.chat.batcher import MessageInsertBatcher
+from app.chat.models import Message, MessageArchive, get_conversation_id
+from app.chat.repository import InboxRepository
+from app.chat.schemas import ChatSocketMessageIn
+from core.db.mongo_session import init_db_beanie
+from core.utils.ids import uuid7, uuid7_lower_bound
+
+
+def make_message(sender_id: uuid.UUID, recipient_id: uuid.UUID, content: str = "hello", **fields) -> Message:
+    # not validated, so no MongoDB connection is needed
+    return Message.model_construct(
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        conversation_id=get_conversation_id(sender_id, recipient_id),
+        content=content,
+        **fields
+    )
+
+
+@pytest.fixture()
+async def mongo():
+    await init_db_beanie()
+
+
+class FakeMessageRepository:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def add_bulk(self, messages: list[Message]) -> dict[int, dict]:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        self.batches.append(messages)
+        return {}
+
+
+class FakeIndexRepository:
+    def __init__(self):
+        self.messages = []
+
+    async def add_messages(self, messages: list[Message]) -> None:
+        self.messages += messages
+
+
+def make_batcher(max_delay: float, max_batch_size: int, max_concurrent_batches: int = 4,
+                 delay: float = 0) -> MessageInsertBatcher:
+    batcher = MessageInsertBatcher(
+        max_delay=max_delay, max_batch_size=max_batch_size, max_concurrent_batches=max_concurrent_batches
+    )
+    batcher.message_repository = FakeMessageRepository(delay=delay)
+    batcher.inbox_repository = FakeIndexRepository()
+    batcher.message_search_repository = FakeIndexRepository()
+    return batcher
+
+
+def test_ChatSocketMessageIn_ClientMessageIdRequired():
+    frame = {"type": "message", "recipient_id": str(uuid.uuid4()), "content": "hello"}
+
+    with pytest.raises(ValidationError):
+        ChatSocketMessageIn.model_validate(frame)
+
+    message = ChatSocketMessageIn.model_validate({**frame, "client_message_id": "retry-1"})
+    assert message.client_message_id == "retry-1"
+
+
+def test_Uuid7_Ordered():
+    ids = [uuid7() for _ in range(10000)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(message_id.version == 7 for message_id in ids)
+
+
+def test_Uuid7_TimestampInFirstBits():
+    before = time.time_ns() // 1_000_000
+    message_id = uuid7()
+
+    # ids generated in a burst may borrow a few milliseconds ahead
+    assert before <= message_id.int >> 80 < before + 1000
+
+
+def test_Uuid7LowerBound_SortsBeforeLaterIds():
+    bound = uuid7_lower_bound(time.time() - 1)
+
+    assert bound < uuid7()
+    assert uuid7_lower_bound(time.time() - 3600) < bound
+
+
+async def test_MessageInsertBatcher_FlushesFullBatch():
+    batcher = make_batcher(max_delay=60, max_batch_size=3)
+    messages = [make_message(uuid.uuid4(), uuid.uuid4()) for _ in range(3)]
+
+    stored = await asyncio.wait_for(batcher.add_many(messages), timeout=1)
+    await batcher.stop()
+
+    assert stored == messages
+    assert batcher.message_repository.batches == [messages]
+    assert batcher.inbox_repository.messages == messages
+    assert batcher.message_search_repository.messages == messages
+
+
+async def test_MessageInsertBatcher_FlushesAfterDelay():
+    batcher = make_batcher(max_delay=0.05, max_batch_size=100)
+    messages = [make_message(uuid.uuid4(), uuid.uuid4()) for _ in range(2)]
+
+    start = time.perf_counter()
+    await batcher.add_many(messages)
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+
+    assert elapsed >= 0.05
+    assert batcher.message_repository.batches == [messages]
+
+
+async def test_MessageInsertBatcher_LimitsConcurrentBatches():
+    batcher = make_batcher(max_delay=60, max_batch_size=1, max_concurrent_batches=2, delay=0.02)
+    messages = [make_message(uuid.uuid4(), uuid.uuid4()) for _ in range(6)]
+
+    await batcher.add_many(messages)
+    await batcher.stop()
+
+    assert len(batcher.message_repository.batches) == 6
+    assert batcher.message_repository.max_in_flight == 2
+    assert sorted(map(id, batcher.inbox_repository.messages)) == sorted(map(id, messages))
+
+
+async def test_InboxAddMessages_CountsUnreadAndKeepsNewestPreview(mongo):
+    sender_id, recipient_id = uuid.uuid4(), uuid.uuid4()
+    now = datetime.now(timezone.utc)
+    await InboxRepository.add_messages(messages=[
+        make_message(sender_id, recipient_id, "first", created_at=now),
+        # a field path if it was not written as a literal
+        make_message(sender_id, recipient_id, "$unread_count", created_at=now + timedelta(seconds=1)),
+    ])
+    # a batch written late, its message is older than the preview
+    await InboxRepository.add_messages(messages=[
+        make_message(sender_id, recipient_id, "late", created_at=now - timedelta(minutes=1))
+    ])
+
+    recipient_inbox, = await InboxRepository.find_by_user_id(
+        user_id=recipient_id, before=None, before_conversation_id=None, limit=10
+    )
+    assert recipient_inbox.unread_count == 3
+    assert recipient_inbox.last_message_preview == "$unread_count"
+    assert recipient_inbox.other_user_id == sender_id
+
+    sender_inbox, = await InboxRepository.find_by_user_id(
+        user_id=sender_id, before=None, before_conversation_id=None, limit=10
+    )
+    assert sender_inbox.unread_count == 0
+    assert sender_inbox.last_message_preview == "$unread_count"
+    assert sender_inbox.other_user_id == recipient_id
+
+
+def test_EncodeMessages_ZstdRoundTrip():
+    sender_id, recipient_id = uuid.uuid4(), uuid.uuid4()
+    messages = [
+        make_message(sender_id, recipient_id, f"message {i} ✓", client_message_id=f"client-{i}")
+        for i in range(50)
+    ]
+
+    data = encode_messages(messages)
+    decoded = decode_messages(data)
+
+    # zstd frame magic number
+    assert data[:4] == b"\x28\xb5\x2f\xfd"
+    assert [message.id for message in decoded] == [message.id for message in messages]
+    assert [message.content for message in decoded] == [message.content for message in messages]
+    assert [message.created_at for message in decoded] == [message.created_at for message in messages]
+    assert decoded[0].client_message_id == "client-0"
+
+
+async def test_MessageArchiver_ReadsLocalBlobOnce(tmp_path):
+    sender_id, recipient_id = uuid.uuid4(), uuid.uuid4()
+    messages = [make_message(sender_id, recipient_id, f"message {i}") for i in range(3)]
+    storage = LocalArchiveStorage(path=str(tmp_path))
+    archiver = MessageArchiver(storage=storage, chunk_size=10, cache_size=1)
+    archive = MessageArchive.model_construct(key=f"{uuid.uuid4()}/{messages[0].id}.jsonl.zst", message_count=3)
+
+    await storage.put(archive.key, encode_messages(messages))
+    read = await archiver.read(archive)
+    (tmp_path / archive.key).unlink()
+
+    assert [message.id for message in read] == [message.id for message in messages]
+    # served from memory, the blob is gone
+    assert await archiver.read(archive) is read
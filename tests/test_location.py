@@ -0,0 +1,216 @@
+import asyncio
+import json
+from datetime import datetime
+from uuid import UUID
+
+from starlette import status
+
+from app.friends.models import Friendship
+from app.friends.friendship_status_enum import FriendshipStatusEnum
+from app.friends.service import FriendshipService
+from app.location.schemas import LocationBase
+from app.location.service import LocationService
+from app.location.write_behind import location_write_behind_buffer
+from core.exceptions import InvalidBoundingBox, LocationNotFound, UsersNotFriends
+from tests.conftest import UserFactory, fake
+
+
+def generate_user_data() -> dict:
+    return {
+        "username": fake.user_name(),
+        "email": fake.ascii_email(),
+        "password": fake.password(length=10),
+        "fullname": fake.name(),
+        "birthdate": datetime.strftime(fake.date_of_birth(minimum_age=14, maximum_age=100), "%Y-%m-%d"),
+    }
+
+
+async def generate_friendships(user_id: str, friend_ids: list[str], session):
+    friendships = []
+    for friend_id in friend_ids:
+        friendships.append(
+            Friendship(requester_id=user_id, addressee_id=friend_id, status=FriendshipStatusEnum.accepted.value)
+        )
+        friendships.append(
+            Friendship(requester_id=friend_id, addressee_id=user_id, status=FriendshipStatusEnum.accepted.value)
+        )
+
+    session.add_all(friendships)
+    await session.commit()
+    return friendships
+
+
+async def test_GetNearbyFriends_Success(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    created_users = [await user_factory.create_user(generate_user_data()) for _ in range(4)]
+    user, near_friend, far_friend, stranger = created_users
+
+    await generate_friendships(
+        user_id=user["id"],
+        friend_ids=[near_friend["id"], far_friend["id"]],
+        session=session
+    )
+
+    positions = {
+        user["id"]: {"longitude": 13.4050, "latitude": 52.5200},
+        near_friend["id"]: {"longitude": 13.4100, "latitude": 52.5210},
+        far_friend["id"]: {"longitude": 2.3522, "latitude": 48.8566},
+        stranger["id"]: {"longitude": 13.4060, "latitude": 52.5201},
+    }
+    for user_id, position in positions.items():
+        authorized_client = user_factory.authorize_client(user_id)
+        res = await authorized_client.post("/location/", json=position)
+        assert res.status_code == status.HTTP_200_OK
+
+    authorized_client = user_factory.authorize_client(user["id"])
+    res = await authorized_client.get("/location/nearby", params={"radius": 5000})
+
+    res_json = res.json()
+    assert res.status_code == status.HTTP_200_OK
+    assert [location["user_id"] for location in res_json] == [near_friend["id"]]
+    assert res_json[0]["distance"] < 5000
+
+
+async def test_GetNearbyFriends_NoOwnLocation(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    created_user = await user_factory.create_user(generate_user_data())
+
+    authorized_client = user_factory.authorize_client(created_user["id"])
+    res = await authorized_client.get("/location/nearby")
+
+    assert res.status_code == LocationNotFound.code
+
+
+async def test_GetNearbyFriends_Unauthorized(async_client, session):
+    res = await async_client.get("/location/nearby")
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+async def test_GetLocationHistory_Success(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    user, friend = [await user_factory.create_user(generate_user_data()) for _ in range(2)]
+    await generate_friendships(user_id=user["id"], friend_ids=[friend["id"]], session=session)
+
+    authorized_client = user_factory.authorize_client(friend["id"])
+    for i in range(3):
+        await authorized_client.post("/location/", json={"longitude": 13.40 + i / 100, "latitude": 52.52})
+    await location_write_behind_buffer.flush()
+
+    authorized_client = user_factory.authorize_client(user["id"])
+    res = await authorized_client.get(f"/location/{friend['id']}/history", params={"limit": 2})
+    first_page = res.json()
+
+    assert res.status_code == status.HTTP_200_OK
+    assert [point["longitude"] for point in first_page["items"]] == [13.40, 13.41]
+    assert first_page["has_more"]
+
+    res = await authorized_client.get(
+        f"/location/{friend['id']}/history",
+        params={"limit": 2, "cursor": first_page["next_cursor"]}
+    )
+    second_page = res.json()
+
+    assert [point["longitude"] for point in second_page["items"]] == [13.42]
+    assert not second_page["has_more"]
+
+
+async def test_GetLocationHistory_NotFriends(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    user, stranger = [await user_factory.create_user(generate_user_data()) for _ in range(2)]
+
+    authorized_client = user_factory.authorize_client(user["id"])
+    res = await authorized_client.get(f"/location/{stranger['id']}/history")
+
+    assert res.status_code == UsersNotFriends.code
+
+
+async def test_GetFriendsInViewport_Clusters(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    user, *friends = [await user_factory.create_user(generate_user_data()) for _ in range(4)]
+    await generate_friendships(user_id=user["id"], friend_ids=[friend["id"] for friend in friends], session=session)
+
+    positions = [
+        {"longitude": 13.4050, "latitude": 52.5200},
+        {"longitude": 13.4100, "latitude": 52.5210},
+        {"longitude": 2.3522, "latitude": 48.8566},
+    ]
+    for friend, position in zip(friends, positions):
+        authorized_client = user_factory.authorize_client(friend["id"])
+        await authorized_client.post("/location/", json=position)
+
+    authorized_client = user_factory.authorize_client(user["id"])
+    res = await authorized_client.get("/location/viewport", params={"bbox": "-10,35,30,60", "zoom": 4})
+
+    res_json = res.json()
+    assert res.status_code == status.HTTP_200_OK
+    assert res_json["locations"] == []
+    assert sorted(cluster["count"] for cluster in res_json["clusters"]) == [1, 2]
+
+    res = await authorized_client.get("/location/viewport", params={"bbox": "13,52,14,53", "zoom": 15})
+
+    res_json = res.json()
+    assert res_json["clusters"] == []
+    assert {location["user_id"] for location in res_json["locations"]} == {friends[0]["id"], friends[1]["id"]}
+
+
+async def test_GetFriendsInViewport_CrossesAntimeridian(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    user, *friends = [await user_factory.create_user(generate_user_data()) for _ in range(4)]
+    await generate_friendships(user_id=user["id"], friend_ids=[friend["id"] for friend in friends], session=session)
+
+    positions = [
+        {"longitude": 179.5, "latitude": -17.7},
+        {"longitude": -179.5, "latitude": -16.5},
+        {"longitude": 0.0, "latitude": -17.0},
+    ]
+    for friend, position in zip(friends, positions):
+        authorized_client = user_factory.authorize_client(friend["id"])
+        await authorized_client.post("/location/", json=position)
+
+    authorized_client = user_factory.authorize_client(user["id"])
+    res = await authorized_client.get("/location/viewport", params={"bbox": "170,-20,-170,-10", "zoom": 15})
+
+    res_json = res.json()
+    assert res.status_code == status.HTTP_200_OK
+    assert {location["user_id"] for location in res_json["locations"]} == {friends[0]["id"], friends[1]["id"]}
+
+    res = await authorized_client.get("/location/viewport", params={"bbox": "170,-20,-170,-10", "zoom": 2})
+
+    res_json = res.json()
+    assert res_json["locations"] == []
+    assert sum(cluster["count"] for cluster in res_json["clusters"]) == 2
+
+
+async def test_GetFriendsInViewport_InvalidBoundingBox(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    created_user = await user_factory.create_user(generate_user_data())
+
+    authorized_client = user_factory.authorize_client(created_user["id"])
+    res = await authorized_client.get("/location/viewport", params={"bbox": "13,53,14", "zoom": 4})
+
+    assert res.status_code == InvalidBoundingBox.code
+
+
+async def test_StreamFriendsLocations_SnapshotSameShapeAsLive(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    user, friend = [await user_factory.create_user(generate_user_data()) for _ in range(2)]
+    await generate_friendships(user_id=user["id"], friend_ids=[friend["id"]], session=session)
+
+    authorized_client = user_factory.authorize_client(friend["id"])
+    await authorized_client.post("/location/", json={"longitude": 13.4050, "latitude": 52.5200})
+
+    location_service = LocationService()
+    stream = location_service.subscribe_friends_locations(user_id=user["id"], friendship_service=FriendshipService())
+    try:
+        snapshot = json.loads(await anext(stream))
+        await location_service.publish_location(
+            LocationBase(longitude=13.4100, latitude=52.5210), user_id=UUID(friend["id"])
+        )
+        live = json.loads(await asyncio.wait_for(anext(stream), timeout=5))
+    finally:
+        await stream.aclose()
+
+    assert snapshot.keys() == live.keys()
+    assert snapshot["user_id"] == live["user_id"] == friend["id"]
+    # positions come back from the GEO set with a small rounding error
+    assert (round(snapshot["longitude"], 4), round(live["longitude"], 4)) == (13.4050, 13.4100)
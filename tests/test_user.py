@@ -141,7 +141,59 @@ async def test_GetAllUsers_Successful(async_client, session):
     assert res.status_code == status.HTTP_200_OK
 
 
+async def test_GetAllUsers_Paginated(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    data = [
+        {
+            "username": fake.user_name(),
+            "email": fake.ascii_email(),
+            "password": fake.password(length=10),
+            "fullname": fake.name(),
+            "birthdate": datetime.strftime(fake.date_of_birth(minimum_age=14, maximum_age=100), "%Y-%m-%d"),
+        }
+        for _ in range(3)
+    ]
+    created_clients = [await user_factory.create_user(user) for user in data]
+    authorized_client = user_factory.authorize_client(str(created_clients[0]["id"]))
+
+    res = await authorized_client.get("/users/", params={"limit": 2})
+    assert res.status_code == status.HTTP_200_OK
+    first_page = user_schemas.UserPage(**res.json())
+    assert len(first_page.items) == 2
+    assert first_page.has_more
+    assert first_page.next_after_id == first_page.items[-1].id
+
+    res = await authorized_client.get("/users/", params={"limit": 2, "after_id": str(first_page.next_after_id)})
+    assert res.status_code == status.HTTP_200_OK
+    second_page = user_schemas.UserPage(**res.json())
+    assert second_page.items
+    assert all(user.id > first_page.next_after_id for user in second_page.items)
+
+
 async def test_GetAllUsers_Unauthorized(async_client, session):
     res = await async_client.get("/users/")
     assert res.status_code == status.HTTP_401_UNAUTHORIZED
 
+
+async def test_UpdateUser_GetUserReturnsUpdated(async_client, session):
+    user_factory = UserFactory(async_client=async_client, session=session)
+    data = {
+        "username": fake.user_name(),
+        "email": fake.ascii_email(),
+        "password": fake.password(length=10),
+        "fullname": fake.name(),
+        "birthdate": datetime.strftime(fake.date_of_birth(minimum_age=14, maximum_age=100), "%Y-%m-%d"),
+    }
+    created_user = await user_factory.create_user(data)
+    authorized_client = user_factory.authorize_client(str(created_user["id"]))
+
+    # cache the user before updating it
+    res = await authorized_client.get(f"/users/{created_user['id']}")
+    assert res.json()["fullname"] == data["fullname"]
+
+    res = await authorized_client.patch("/users/", json={"id": created_user["id"], "fullname": "Updated Name"})
+    assert res.status_code == status.HTTP_200_OK
+
+    res = await authorized_client.get(f"/users/{created_user['id']}")
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json()["fullname"] == "Updated Name"